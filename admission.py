@@ -0,0 +1,271 @@
+"""Per-user admission control and fair queuing for LLM calls.
+
+AdmissionController keeps two token buckets per user - requests and
+estimated LLM tokens. Bucket state lives in the llm_quota table and is
+updated under SELECT ... FOR UPDATE, so every replica enforces the same
+quota. If the database is unreachable it falls back to in-process buckets.
+
+FairQueue sits in front of the Groq client: it caps concurrent calls
+process-wide and, when callers have to wait, serves users in weighted
+fair order (start-time fair queuing), so one busy user can't starve the rest.
+"""
+import contextlib
+import itertools
+import math
+import os
+import threading
+import time
+
+from mysql.connector import Error
+
+USER_REQUESTS_PER_MINUTE = float(os.getenv("USER_REQUESTS_PER_MINUTE", "20"))
+USER_REQUEST_BURST = float(os.getenv("USER_REQUEST_BURST", "10"))
+USER_TOKENS_PER_MINUTE = float(os.getenv("USER_TOKENS_PER_MINUTE", "60000"))
+USER_TOKEN_BURST = float(os.getenv("USER_TOKEN_BURST", "30000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+IMAGE_TOKENS = 1500             # Rough prompt cost of one image
+# Fair-share weights by username, e.g. "alice=2,batch_bot=0.5" (default 1)
+LLM_USER_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (item.partition("=") for item in os.getenv("LLM_USER_WEIGHTS", "").split(","))
+    if name.strip() and weight
+}
+
+
+class QuotaExceeded(Exception):
+    """Raised when a user's request or token allowance is used up"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Usage limit reached. Please try again in {math.ceil(retry_after)}s.")
+
+
+def estimate_request_tokens(messages, max_tokens=0, image_tokens=IMAGE_TOKENS):
+    """Rough prompt + completion token estimate (~4 characters per token, image_tokens per image)"""
+    tokens = max_tokens or 0
+    for message in messages:
+        content = message.get("content", "")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                tokens += image_tokens
+            else:
+                tokens += len(part.get("text") or "") // 4 + 1
+    return tokens
+
+
+def _refill(allowance, capacity, per_minute, elapsed):
+    return min(capacity, allowance + max(0.0, elapsed) * per_minute / 60)
+
+
+def _retry_after(allowance, needed, per_minute):
+    return max(0.0, (needed - allowance) * 60 / per_minute)
+
+
+class AdmissionController:
+    """Per-user token buckets for request count and estimated tokens"""
+
+    def __init__(self, connect):
+        self.connect = connect      # returns a MySQL connection or None
+        self.lock = threading.Lock()
+        self.local = {}             # user_id -> (requests, tokens, updated_at) when the DB is unavailable
+
+    def admit(self, user_id, tokens, wait=False, cancel=None):
+        """Take one request and `tokens` from the user's allowance, or raise QuotaExceeded.
+
+        With wait=True, sleep until the allowance refills instead of raising;
+        setting the optional cancel Event ends the wait with QuotaExceeded.
+        """
+        # A request larger than the whole bucket would never fit; cap it at the burst size
+        tokens = min(tokens, USER_TOKEN_BURST)
+        cancel = cancel or threading.Event()
+        while True:
+            retry_after = self._take(user_id, tokens)
+            if retry_after <= 0:
+                return
+            if not wait or cancel.wait(min(retry_after, 5.0)):
+                raise QuotaExceeded(retry_after)
+
+    def _take(self, user_id, tokens):
+        """Try to take from the buckets; returns 0 on success, else seconds until it would fit"""
+        try:
+            return self._take_db(user_id, tokens)
+        except Error:
+            return self._take_local(user_id, tokens)
+
+    def _take_db(self, user_id, tokens):
+        connection = self.connect()
+        if not connection or not connection.is_connected():
+            raise Error("Database connection failed")
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            now = time.time()
+            cursor.execute(
+                """INSERT IGNORE INTO llm_quota (user_id, request_allowance, token_allowance, updated_at)
+                   VALUES (%s, %s, %s, %s)""",
+                (user_id, USER_REQUEST_BURST, USER_TOKEN_BURST, now)
+            )
+            cursor.execute(
+                "SELECT request_allowance, token_allowance, updated_at FROM llm_quota WHERE user_id = %s FOR UPDATE",
+                (user_id,)
+            )
+            requests, allowance, updated_at = cursor.fetchone()
+            requests, allowance, retry_after = self._spend(requests, allowance, now - updated_at, tokens)
+            cursor.execute(
+                "UPDATE llm_quota SET request_allowance = %s, token_allowance = %s, updated_at = %s WHERE user_id = %s",
+                (requests, allowance, now, user_id)
+            )
+            connection.commit()
+            return retry_after
+        except Error:
+            connection.rollback()
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            if connection.is_connected():
+                connection.close()
+
+    def _take_local(self, user_id, tokens):
+        with self.lock:
+            now = time.time()
+            requests, allowance, updated_at = self.local.get(user_id, (USER_REQUEST_BURST, USER_TOKEN_BURST, now))
+            requests, allowance, retry_after = self._spend(requests, allowance, now - updated_at, tokens)
+            self.local[user_id] = (requests, allowance, now)
+            return retry_after
+
+    def _spend(self, requests, allowance, elapsed, tokens):
+        """Refill both buckets, then spend from them if both have room"""
+        requests = _refill(requests, USER_REQUEST_BURST, USER_REQUESTS_PER_MINUTE, elapsed)
+        allowance = _refill(allowance, USER_TOKEN_BURST, USER_TOKENS_PER_MINUTE, elapsed)
+        retry_after = max(
+            _retry_after(requests, 1, USER_REQUESTS_PER_MINUTE),
+            _retry_after(allowance, tokens, USER_TOKENS_PER_MINUTE)
+        )
+        if retry_after <= 0:
+            requests -= 1
+            allowance -= tokens
+        return requests, allowance, retry_after
+
+    def record_usage(self, user_id, chat_type, model, estimated_tokens, total_tokens):
+        """Log a finished call and refund/charge the difference between estimate and actual tokens"""
+        connection = None
+        cursor = None
+        try:
+            connection = self.connect()
+            if not connection or not connection.is_connected():
+                return False
+            cursor = connection.cursor()
+            cursor.execute(
+                """INSERT INTO llm_usage (user_id, chat_type, model, estimated_tokens, total_tokens)
+                   VALUES (%s, %s, %s, %s, %s)""",
+                (user_id, chat_type, model, estimated_tokens, total_tokens)
+            )
+            if total_tokens is not None:
+                cursor.execute(
+                    "UPDATE llm_quota SET token_allowance = LEAST(%s, token_allowance + %s) WHERE user_id = %s",
+                    (USER_TOKEN_BURST, min(estimated_tokens, USER_TOKEN_BURST) - total_tokens, user_id)
+                )
+            connection.commit()
+            return True
+        except Error:
+            if connection:
+                connection.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if connection and connection.is_connected():
+                connection.close()
+
+
+class FairQueue:
+    """Global concurrency cap with weighted fair ordering of waiting callers"""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = []
+        self.virtual_time = 0.0
+        self.last_finish = {}       # user -> finish tag of their latest ticket
+        self.avg_service = 2.0      # EWMA of seconds a call holds a slot
+        self.sequence = itertools.count()
+
+    @contextlib.contextmanager
+    def slot(self, user, cost=1.0, weight=1.0, on_wait=None, poll=0.5):
+        """Hold one of the concurrent call slots; on_wait(position, eta_seconds) is called while queued"""
+        with self.reserve(user, cost, weight, on_wait, poll):
+            yield
+
+    def reserve(self, user, cost=1.0, weight=1.0, on_wait=None, poll=0.5, blocking=True):
+        """Take a slot now and return a context manager that gives it back on exit.
+
+        The slot can be handed to another thread (e.g. a worker running the call).
+        With blocking=False, returns None instead of queueing when no slot is free.
+        """
+        if self._acquire(user, cost, weight, on_wait, poll, blocking) is None:
+            return None
+        return _HeldSlot(self)
+
+    def _acquire(self, user, cost, weight, on_wait, poll, blocking=True):
+        with self.cond:
+            if not blocking and (self.active >= self.max_concurrency or self.waiting):
+                return None
+            start = max(self.virtual_time, self.last_finish.get(user, 0.0))
+            ticket = (start, start + cost / max(weight, 1e-6), next(self.sequence))
+            self.last_finish[user] = ticket[1]
+            self.waiting.append(ticket)
+            try:
+                while self.active >= self.max_concurrency or min(self.waiting) != ticket:
+                    if on_wait:
+                        position, eta = self._position(ticket)
+                        # Run the callback without the lock so a slow UI update can't stall the queue
+                        self.cond.release()
+                        try:
+                            on_wait(position, eta)
+                        finally:
+                            self.cond.acquire()
+                    self.cond.wait(poll)
+            except BaseException:
+                # Aborted while queued (e.g. Streamlit rerun/stop): give up the place in line
+                self.waiting.remove(ticket)
+                self.cond.notify_all()
+                raise
+            self.waiting.remove(ticket)
+            self.active += 1
+            self.virtual_time = max(self.virtual_time, ticket[0])
+            return ticket
+
+    def _release(self, held):
+        with self.cond:
+            self.active -= 1
+            self.avg_service = 0.8 * self.avg_service + 0.2 * held
+            self.cond.notify_all()
+
+    def _position(self, ticket):
+        """1-based place in line and estimated seconds until a slot frees up"""
+        position = sum(1 for other in self.waiting if other < ticket) + 1
+        free = self.max_concurrency - self.active
+        eta = max(0, position - free) * self.avg_service / self.max_concurrency
+        return position, eta
+
+    def snapshot(self):
+        with self.cond:
+            return {"active": self.active, "waiting": len(self.waiting), "max_concurrency": self.max_concurrency}
+
+
+class _HeldSlot:
+    """An acquired FairQueue slot, released when the with-block exits"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.queue._release(time.monotonic() - self.started)
+        return False
@@ -0,0 +1,187 @@
+"""Process-wide content-addressed blob store.
+
+Documents and images are kept once per process as raw bytes, keyed by their
+SHA-256, no matter how many sessions use them. Sessions hold only the hash
+(a handle). Each owner - e.g. (user, "pdf_text") - holds one reference
+until it is released or points at another blob; blobs nobody references
+are dropped. When resident bytes exceed the memory
+limit, least recently used blobs are spilled to disk and read back on
+demand. Base64 is produced only when a request needs it.
+"""
+import atexit
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+BLOB_MEMORY_LIMIT = int(os.getenv("BLOB_MEMORY_LIMIT_MB", "256")) * 2 ** 20
+# Each process spills into its own subdirectory, removed when the process exits
+BLOB_SPILL_DIR = os.getenv("BLOB_SPILL_DIR", os.path.join(".cache", "blobs"))
+
+
+def _to_bytes(data):
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+class BlobStore:
+    """Reference-counted, deduplicated blobs with LRU spill to disk"""
+
+    def __init__(self, memory_limit=BLOB_MEMORY_LIMIT, spill_dir=BLOB_SPILL_DIR):
+        self.memory_limit = memory_limit
+        self.spill_root = spill_dir
+        self.spill_dir = None           # created on first spill
+        self.lock = threading.Lock()
+        self.resident = OrderedDict()   # handle -> bytes, least recently used first
+        self.sizes = {}                 # handle -> size in bytes (resident or spilled)
+        self.refs = {}                  # handle -> set of owners
+        self.owners = {}                # owner -> handle
+        self.base64_handles = set()     # blobs that would otherwise be kept as base64 (images)
+        self.resident_bytes = 0
+        self.counters = {"evictions": 0, "disk_reads": 0, "dedup_hits": 0}
+
+    def put(self, data, owner, sent_as_base64=False):
+        """Store data for owner (replacing owner's previous blob); returns the handle.
+
+        sent_as_base64 marks blobs that requests send base64-encoded, for the savings stats.
+        """
+        raw = _to_bytes(data)
+        handle = hashlib.sha256(raw).hexdigest()
+        with self.lock:
+            if sent_as_base64:
+                self.base64_handles.add(handle)
+            previous = self.owners.get(owner)
+            if previous == handle:
+                # May load a spilled blob back, so the memory limit still applies
+                self._touch(handle, raw)
+                self._evict(keep=handle)
+                return handle
+            if handle in self.sizes:
+                self.counters["dedup_hits"] += 1
+                self._touch(handle, raw)
+            else:
+                self.sizes[handle] = len(raw)
+                self._make_resident(handle, raw)
+            self.refs.setdefault(handle, set()).add(owner)
+            self.owners[owner] = handle
+            if previous:
+                self._unref(previous, owner)
+            self._evict()
+        return handle
+
+    def release(self, owner):
+        """Drop owner's reference; the blob is deleted once nobody references it"""
+        with self.lock:
+            handle = self.owners.pop(owner, None)
+            if handle:
+                self._unref(handle, owner)
+
+    def get(self, handle):
+        """Raw bytes for a handle (read back from disk if spilled), or None"""
+        if not handle:
+            return None
+        with self.lock:
+            raw = self.resident.get(handle)
+            if raw is not None:
+                self.resident.move_to_end(handle)
+                return raw
+            if handle not in self.sizes:
+                return None
+        try:
+            with open(self._spill_path(handle), "rb") as f:
+                raw = f.read()
+        except OSError:
+            return None
+        with self.lock:
+            self.counters["disk_reads"] += 1
+            if handle in self.sizes and handle not in self.resident:
+                self._make_resident(handle, raw)
+                self._evict(keep=handle)
+        return raw
+
+    def text(self, handle):
+        raw = self.get(handle)
+        return raw.decode("utf-8") if raw is not None else None
+
+    def b64(self, handle):
+        """Base64 of a blob, built on demand rather than kept in memory"""
+        raw = self.get(handle)
+        return base64.b64encode(raw).decode("ascii") if raw is not None else None
+
+    def stats(self):
+        with self.lock:
+            referenced = sum(self.sizes[h] * len(owners) for h, owners in self.refs.items())
+            referenced_base64 = sum(
+                self.sizes[h] * len(owners) for h, owners in self.refs.items() if h in self.base64_handles
+            )
+            stored = sum(self.sizes.values())
+            return {
+                "blobs": len(self.sizes),
+                "references": sum(len(owners) for owners in self.refs.values()),
+                "resident_bytes": self.resident_bytes,
+                "spilled_bytes": stored - self.resident_bytes,
+                # Bytes that per-session copies would have needed, minus what is actually stored
+                "dedup_saved_bytes": referenced - stored,
+                # Keeping images as raw bytes instead of base64 avoids its 4/3 expansion
+                "base64_saved_bytes": referenced_base64 // 3,
+                **self.counters
+            }
+
+    def _spill_path(self, handle, create=False):
+        if self.spill_dir is None and create:
+            # Private to this store, so another process can't delete files it still needs
+            os.makedirs(self.spill_root, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.spill_root)
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+        return os.path.join(self.spill_dir, handle)
+
+    def _make_resident(self, handle, raw):
+        self.resident[handle] = raw
+        self.resident_bytes += len(raw)
+
+    def _touch(self, handle, raw):
+        if handle in self.resident:
+            self.resident.move_to_end(handle)
+        else:
+            self._make_resident(handle, raw)
+
+    def _unref(self, handle, owner):
+        owners = self.refs.get(handle)
+        if owners is None:
+            return
+        owners.discard(owner)
+        if owners:
+            return
+        del self.refs[handle]
+        del self.sizes[handle]
+        self.base64_handles.discard(handle)
+        raw = self.resident.pop(handle, None)
+        if raw is not None:
+            self.resident_bytes -= len(raw)
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(handle))
+            except OSError:
+                pass
+
+    def _evict(self, keep=None):
+        """Spill least recently used blobs to disk until under the memory limit"""
+        while self.resident_bytes > self.memory_limit and len(self.resident) > 1:
+            handle, raw = next(iter(self.resident.items()))
+            if handle == keep:
+                self.resident.move_to_end(handle)
+                handle, raw = next(iter(self.resident.items()))
+            try:
+                path = self._spill_path(handle, create=True)
+                if not os.path.exists(path):
+                    with open(path + ".tmp", "wb") as f:
+                        f.write(raw)
+                    os.replace(path + ".tmp", path)
+            except OSError:
+                # Can't spill (e.g. disk full): keep it in memory
+                break
+            del self.resident[handle]
+            self.resident_bytes -= len(raw)
+            self.counters["evictions"] += 1
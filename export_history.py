@@ -0,0 +1,177 @@
+"""Streaming export of a user's full chat history.
+
+Rows are read from MySQL through an unbuffered cursor and written out in
+chunks, so memory use stays flat no matter how many messages are exported.
+
+Usage:
+    python export_history.py --user-id 1 --format jsonl --gzip -o history.jsonl.gz
+"""
+import argparse
+import json
+import os
+import sys
+import zlib
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+from dotenv import load_dotenv
+
+EXPORT_FORMATS = {
+    "jsonl": ("jsonl", "application/x-ndjson"),
+    "markdown": ("md", "text/markdown")
+}
+CHAT_TYPES = ["chat", "pdf", "image"]
+EXPORT_BATCH_SIZE = 1000        # Rows fetched from the server per round trip
+EXPORT_CHUNK_BYTES = 64 * 1024  # Output is flushed in chunks of roughly this size
+
+
+def export_file_info(fmt, compress=False):
+    """Return (file extension, mime type) for an export"""
+    extension, mime = EXPORT_FORMATS[fmt]
+    if compress:
+        return f"{extension}.gz", "application/gzip"
+    return extension, mime
+
+
+def iter_history_rows(connection, user_id, chat_types=None, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield chat_history rows for a user, oldest first, without buffering the result set"""
+    query = "SELECT chat_id, chat_type, role, content, created_at FROM chat_history WHERE user_id = %s"
+    params = [user_id]
+    if chat_types:
+        query += f" AND chat_type IN ({', '.join(['%s'] * len(chat_types))})"
+        params.extend(chat_types)
+    if start:
+        query += " AND created_at >= %s"
+        params.append(_as_datetime(start))
+    if end:
+        end_at = _as_datetime(end)
+        if not isinstance(end, datetime):
+            # A plain end date includes that whole day
+            end_at += timedelta(days=1)
+        query += " AND created_at < %s"
+        params.append(end_at)
+    query += " ORDER BY created_at ASC, chat_id ASC"
+
+    cursor = connection.cursor(dictionary=True, buffered=False)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        # Drain any unread rows (e.g. the consumer stopped early) so the cursor can close
+        if connection.unread_result:
+            connection.consume_results()
+        cursor.close()
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
+
+
+def _format_jsonl(row):
+    return json.dumps({
+        "chat_id": row["chat_id"],
+        "chat_type": row["chat_type"],
+        "role": row["role"],
+        "content": row["content"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None
+    }, ensure_ascii=False) + "\n"
+
+
+def _format_markdown(row):
+    created = row["created_at"].strftime("%Y-%m-%d %H:%M:%S") if row["created_at"] else ""
+    return f"### {row['role'].upper()} · {row['chat_type']} · {created}\n\n{row['content']}\n\n---\n\n"
+
+
+def iter_export(connection, user_id, fmt="jsonl", compress=False, chat_types=None, start=None, end=None,
+                username=None, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yield the export as byte chunks in JSONL or Markdown, optionally gzip-compressed"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    format_row = _format_jsonl if fmt == "jsonl" else _format_markdown
+    # wbits=31 writes a gzip header/trailer so the stream is a valid .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(data):
+        return compressor.compress(data) if compressor else data
+
+    buffer = []
+    size = 0
+    if fmt == "markdown":
+        header = f"# Chat history{f' – {username}' if username else ''}\n\n"
+        buffer.append(header.encode("utf-8"))
+
+    for row in iter_history_rows(connection, user_id, chat_types, start, end):
+        encoded = format_row(row).encode("utf-8")
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_bytes:
+            data = emit(b"".join(buffer))
+            buffer = []
+            size = 0
+            if data:
+                yield data
+
+    data = emit(b"".join(buffer))
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
+
+
+def write_export(connection, user_id, out, **kwargs):
+    """Stream an export into a binary file object; returns bytes written"""
+    written = 0
+    for chunk in iter_export(connection, user_id, **kwargs):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export a user's chat history")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="jsonl")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the output")
+    parser.add_argument("--types", nargs="+", choices=CHAT_TYPES, help="chat types to include (default: all)")
+    parser.add_argument("--start", help="first day to include (YYYY-MM-DD)")
+    parser.add_argument("--end", help="last day to include (YYYY-MM-DD)")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    connection = mysql.connector.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        user=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        database=os.getenv("DB_NAME", "ai_assistant")
+    )
+    try:
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            write_export(
+                connection,
+                args.user_id,
+                out,
+                fmt=args.format,
+                compress=args.gzip,
+                chat_types=args.types,
+                start=args.start and date.fromisoformat(args.start),
+                end=args.end and date.fromisoformat(args.end)
+            )
+        finally:
+            if args.output:
+                out.close()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""Concurrent-session load test for main.py.
+
+Drives N simulated Streamlit sessions (login, chat turns, PDF upload and
+questions, image analysis) through Streamlit's AppTest runner, in-process,
+against a local fake Groq endpoint and a local MySQL database. Reports
+throughput, per-stage latency percentiles, memory per session and the
+concurrency level at which throughput stops scaling.
+
+Usage:
+    python load_test.py --profile exponential --max-sessions 32 --latency-ms 400
+    python load_test.py --levels 1,4,16 --turns 5 --stream --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+STAGES = ["login", "chat", "pdf_upload", "pdf_question", "image_upload", "image_question"]
+SATURATION_GAIN = 0.10          # Throughput must grow at least this much per level to count as scaling
+
+
+# Fake Groq endpoint
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible /chat/completions endpoint with simulated latency"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+        self.server.count_request()
+
+        if random.random() < config["error_rate"]:
+            self._send_json(503, {"error": {"message": "simulated overload", "type": "service_unavailable"}})
+            return
+
+        tokens = min(body.get("max_tokens") or config["reply_tokens"], config["reply_tokens"])
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+        reply = [random.choice(words) for _ in range(tokens)]
+        time.sleep(max(0.0, random.gauss(config["latency_ms"], config["jitter_ms"])) / 1000)
+
+        if body.get("stream") or config["force_stream"]:
+            self._stream(body, reply, config)
+        else:
+            time.sleep(tokens / config["tokens_per_second"])
+            self._send_json(200, self._completion(body, " ".join(reply), tokens))
+
+    def _completion(self, body, content, tokens):
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens}
+        }
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, body, reply, config):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for word in reply:
+            time.sleep(1 / config["tokens_per_second"])
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, config):
+        super().__init__(("127.0.0.1", port), FakeGroqHandler)
+        self.config = config
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def start_fake_groq(port=0, **config):
+    """Start the fake endpoint on a background thread and return the server"""
+    server = FakeGroqServer(port, config)
+    threading.Thread(target=server.serve_forever, name="fake-groq", daemon=True).start()
+    return server
+
+
+# Test fixtures
+def make_pdf(lines):
+    """Build a small single-page PDF containing the given text lines"""
+    text = "BT /F1 11 Tf 50 780 Td 14 TL " + " ".join(
+        "({}) '".format(line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")) for line in lines
+    ) + " ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(text)} >>\nstream\n{text}\nendstream".encode("latin-1"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode("ascii") + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii"))
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode("ascii"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+    return out.getvalue()
+
+
+def make_image(size=(800, 600)):
+    """Build a PNG test image with some shapes on it"""
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", size, (240, 240, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((50, 50, 300, 250), fill=(102, 126, 234))
+    draw.ellipse((400, 200, 700, 500), fill=(118, 75, 162))
+    draw.text((60, 520), "Load test image", fill=(0, 0, 0))
+    out = BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+# Simulated session
+class SessionFailed(Exception):
+    pass
+
+
+class SimulatedSession:
+    """One browser session driven through main.py with AppTest"""
+
+    def __init__(self, username, args, fixtures, timings, timings_lock):
+        self.username = username
+        self.args = args
+        self.fixtures = fixtures
+        self.timings = timings
+        self.timings_lock = timings_lock
+
+    def _timed(self, stage, action):
+        started = time.monotonic()
+        at = action()
+        elapsed = time.monotonic() - started
+        if at.exception or at.error:
+            message = (at.exception[0].message if at.exception else at.error[0].value)
+            raise SessionFailed(f"{stage}: {message}")
+        # A call rejected by the per-user quota is a failure, not a fast answer
+        # (Streamlit may lift the leading ⏳ out of the text into the alert's icon)
+        rejected = [w.value for w in at.warning if w.icon == "⏳" or w.value.startswith("⏳")]
+        if rejected:
+            raise SessionFailed(f"{stage}: {rejected[0]}")
+        with self.timings_lock:
+            self.timings.setdefault(stage, []).append(elapsed)
+        return at
+
+    def _button(self, at, label):
+        for button in at.button:
+            if button.label == label:
+                return button
+        raise SessionFailed(f"button not found: {label}")
+
+    def _select_feature(self, at, feature):
+        radio = next(r for r in at.sidebar.radio if r.label == "Select Mode:")
+        return radio.set_value(feature).run()
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        args = self.args
+        at = AppTest.from_file(APP_FILE, default_timeout=args.timeout)
+        at.run()
+
+        # Register (ignored if the user already exists), then log in
+        at.text_input(key="register_username").set_value(self.username)
+        at.text_input(key="register_email").set_value(f"{self.username}@loadtest.local")
+        at.text_input(key="register_password").set_value("loadtest")
+        at.text_input(key="register_confirm").set_value("loadtest")
+        at = self._button(at, "📝 Register").click().run()
+        at.text_input(key="login_username").set_value(self.username)
+        at.text_input(key="login_password").set_value("loadtest")
+        at = self._timed("login", lambda: self._button(at, "🚀 Login").click().run())
+        if not at.session_state["authenticated"]:
+            raise SessionFailed("login: not authenticated")
+
+        for turn in range(args.turns):
+            at = self._timed("chat", lambda: at.chat_input[0].set_value(f"Question {turn}: what is load testing?").run())
+
+        if args.pdf:
+            at = self._select_feature(at, "📄 PDF Analyzer")
+            at.file_uploader[0].set_value(("handbook.pdf", self.fixtures["pdf"], "application/pdf"))
+            at = self._timed("pdf_upload", lambda: at.run())
+            for turn in range(args.questions):
+                at.text_input(key="pdf_question").set_value(f"What does section {turn} say?")
+                at = self._timed("pdf_question", lambda: self._button(at, "🔍 Get Answer").click().run())
+
+        if args.image:
+            at = self._select_feature(at, "🖼️ Image Q&A")
+            at.file_uploader[0].set_value(("screenshot.png", self.fixtures["image"], "image/png"))
+            at = self._timed("image_upload", lambda: at.run())
+            for turn in range(args.questions):
+                at.text_input(key="image_question").set_value("Describe this image in detail.")
+                at = self._timed("image_question", lambda: self._button(at, "🔍 Analyze").click().run())
+
+
+# Measurement helpers
+def rss_bytes():
+    """Resident set size of this process (Linux), or None if unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemorySampler:
+    """Samples peak RSS on a background thread while a level runs"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self.stop_event.wait(self.interval):
+            current = rss_bytes()
+            if current is not None and (self.peak is None or current > self.peak):
+                self.peak = current
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def ramp_levels(profile, max_sessions, step):
+    """Concurrency levels for a ramp-up profile"""
+    if profile == "linear":
+        levels = list(range(step, max_sessions, step))
+        return levels + [max_sessions]
+    if profile == "spike":
+        return [1, max_sessions]
+    levels = []
+    level = 1
+    while level < max_sessions:
+        levels.append(level)
+        level *= 2
+    return levels + [max_sessions]
+
+
+def run_level(concurrency, args, fixtures, server, run_id):
+    """Run `concurrency` sessions at once and summarise the results"""
+    timings = {}
+    timings_lock = threading.Lock()
+    failures = []
+    completed = []
+    requests_before = server.requests
+    baseline_rss = rss_bytes()
+
+    def worker(index):
+        session = SimulatedSession(f"lt_{run_id}_{concurrency}_{index}", args, fixtures, timings, timings_lock)
+        # Stagger session starts across the ramp window
+        time.sleep(args.ramp_seconds * index / max(concurrency, 1))
+        try:
+            session.run()
+            completed.append(index)
+        except Exception as e:
+            failures.append(str(e))
+
+    started = time.monotonic()
+    with MemorySampler() as sampler:
+        threads = [threading.Thread(target=worker, args=(i,), name=f"session-{i}") for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.monotonic() - started
+
+    llm_requests = server.requests - requests_before
+    memory_per_session = None
+    if baseline_rss is not None and sampler.peak is not None:
+        memory_per_session = max(0, sampler.peak - baseline_rss) / concurrency
+
+    return {
+        "sessions": concurrency,
+        "completed": len(completed),
+        "failed": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "seconds": round(elapsed, 2),
+        "sessions_per_second": round(len(completed) / elapsed, 3),
+        "llm_requests_per_second": round(llm_requests / elapsed, 2),
+        "memory_per_session_mb": round(memory_per_session / 2 ** 20, 2) if memory_per_session is not None else None,
+        "stages": {
+            stage: {
+                "count": len(samples),
+                "p50": round(percentile(samples, 50), 3),
+                "p95": round(percentile(samples, 95), 3),
+                "p99": round(percentile(samples, 99), 3),
+                "mean": round(statistics.mean(samples), 3)
+            }
+            for stage, samples in timings.items()
+        }
+    }
+
+
+def find_saturation(results):
+    """First level where adding sessions no longer raises throughput (or sessions start failing)"""
+    for previous, current in zip(results, results[1:]):
+        if current["failed"]:
+            return previous["sessions"]
+        if current["sessions_per_second"] < previous["sessions_per_second"] * (1 + SATURATION_GAIN):
+            return previous["sessions"]
+    return None
+
+
+def print_report(results, saturation):
+    print()
+    print(f"{'sessions':>8} {'ok':>4} {'fail':>4} {'sess/s':>8} {'llm req/s':>10} {'MB/sess':>8}")
+    for result in results:
+        memory = result["memory_per_session_mb"]
+        print(
+            f"{result['sessions']:>8} {result['completed']:>4} {result['failed']:>4} "
+            f"{result['sessions_per_second']:>8} {result['llm_requests_per_second']:>10} "
+            f"{memory if memory is not None else '-':>8}"
+        )
+        for stage in STAGES:
+            stats = result["stages"].get(stage)
+            if stats:
+                print(f"{'':>10}{stage:<15} p50 {stats['p50']:>7}s  p95 {stats['p95']:>7}s  p99 {stats['p99']:>7}s  (n={stats['count']})")
+        for error in result["errors"]:
+            print(f"{'':>10}! {error}")
+    print()
+    if saturation is None:
+        print("Throughput kept scaling at every level tested; raise --max-sessions to find the saturation point.")
+    else:
+        print(f"Saturation point: ~{saturation} concurrent sessions")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test main.py with concurrent simulated sessions")
+    parser.add_argument("--profile", choices=["exponential", "linear", "spike"], default="exponential")
+    parser.add_argument("--max-sessions", type=int, default=16)
+    parser.add_argument("--step", type=int, default=4, help="session increment for the linear profile")
+    parser.add_argument("--levels", help="explicit comma-separated concurrency levels (overrides --profile)")
+    parser.add_argument("--ramp-seconds", type=float, default=2.0, help="spread session starts over this window")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per session")
+    parser.add_argument("--questions", type=int, default=2, help="PDF/image questions per session")
+    parser.add_argument("--no-pdf", dest="pdf", action="store_false")
+    parser.add_argument("--no-image", dest="image", action="store_false")
+    parser.add_argument("--timeout", type=float, default=120, help="per-run script timeout in seconds")
+    parser.add_argument("--port", type=int, default=0, help="fake Groq port (0 picks a free port)")
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake Groq time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--reply-tokens", type=int, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake Groq calls that return 503")
+    parser.add_argument("--stream", action="store_true", help="always answer with SSE streaming")
+    parser.add_argument("--db-name", default="ai_assistant_loadtest", help="local MySQL database to use")
+    parser.add_argument("--keep-quotas", action="store_true",
+                        help="keep the app's per-user request/token limits instead of lifting them")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    server = start_fake_groq(
+        args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        force_stream=args.stream
+    )
+    # main.py reads these on its first run
+    os.environ["GROQ_BASE_URL"] = server.base_url
+    os.environ["GROQ_API_KEY"] = "gsk_loadtest"
+    os.environ["DB_NAME"] = args.db_name
+    if not args.keep_quotas:
+        # Each simulated user would otherwise hit the default burst (10 requests,
+        # 30000 tokens) and measure quota rejections instead of app capacity
+        for name in ("USER_REQUESTS_PER_MINUTE", "USER_REQUEST_BURST", "USER_TOKENS_PER_MINUTE", "USER_TOKEN_BURST"):
+            os.environ[name] = "1e9"
+
+    fixtures = {
+        "pdf": make_pdf([f"Section {i}: policies, procedures and examples for load testing." for i in range(40)]),
+        "image": make_image()
+    }
+    if args.levels:
+        levels = [int(level) for level in args.levels.split(",")]
+    else:
+        levels = ramp_levels(args.profile, args.max_sessions, args.step)
+    run_id = uuid.uuid4().hex[:6]
+
+    print(f"Fake Groq at {server.base_url} • DB {os.getenv('DB_HOST', 'localhost')}/{args.db_name} • levels {levels}")
+    results = []
+    for level in levels:
+        print(f"▶ {level} concurrent sessions...", flush=True)
+        results.append(run_level(level, args, fixtures, server, run_id))
+
+    saturation = find_saturation(results)
+    print_report(results, saturation)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": results, "saturation_sessions": saturation}, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,24 @@ from groq import Groq
 import os
 from PyPDF2 import PdfReader
 from PIL import Image
-import base64
 from io import BytesIO
 from dotenv import load_dotenv
 import mysql.connector
 from mysql.connector import Error
 import hashlib
 import json
-from datetime import datetime
+import atexit
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timedelta
+from export_history import CHAT_TYPES, EXPORT_FORMATS, export_file_info, write_export
+from session_store import MISSING, content_hash, create_session_store
+from blob_store import BlobStore
+from admission import AdmissionController, FairQueue, QuotaExceeded, LLM_USER_WEIGHTS, estimate_request_tokens
+from model_router import ModelRouter
 
 # Load environment variables
 load_dotenv()
@@ -91,6 +101,32 @@ def init_database():
             )
         """)
         
+        # Per-user LLM allowance (token buckets shared by all replicas)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_quota (
+                user_id INT PRIMARY KEY,
+                request_allowance DOUBLE NOT NULL,
+                token_allowance DOUBLE NOT NULL,
+                updated_at DOUBLE NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+            )
+        """)
+        
+        # LLM usage log
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                usage_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                chat_type VARCHAR(20) NOT NULL,
+                model VARCHAR(100),
+                estimated_tokens INT NOT NULL,
+                total_tokens INT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+                INDEX idx_usage_user (user_id, created_at)
+            )
+        """)
+        
         connection.commit()
         cursor.close()
         connection.close()
@@ -281,15 +317,18 @@ def get_groq_client():
             st.info("Get a valid key from: https://console.groq.com/keys")
             st.stop()
         
+        # Optional endpoint override (e.g. a local stand-in for load testing)
+        base_url = os.getenv("GROQ_BASE_URL") or None
+        
         # Initialize client with just the API key
         try:
-            client = Groq(api_key=api_key)
+            client = Groq(api_key=api_key, base_url=base_url)
             # Test the connection with a simple call
             return client
         except TypeError as te:
             # If there's a TypeError, try alternative initialization
             import groq
-            client = groq.Client(api_key=api_key)
+            client = groq.Client(api_key=api_key, base_url=base_url)
             return client
         
     except Exception as e:
@@ -297,6 +336,297 @@ def get_groq_client():
         st.info("💡 Try: pip install --upgrade groq")
         st.stop()
 
+# Model routing
+TEXT_MODELS = ["llama-3.3-70b-versatile", "llama-3.1-70b-versatile", "mixtral-8x7b-32768"]
+VISION_MODELS = ["meta-llama/llama-4-maverick-17b-128e-instruct", "meta-llama/llama-4-scout-17b-16e-instruct"]
+AUTO_MODEL = "⚡ Auto"
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter()
+
+@st.cache_resource
+def get_admission_controller():
+    return AdmissionController(get_database_connection)
+
+@st.cache_resource
+def get_fair_queue():
+    return FairQueue()
+
+def create_completion(model, candidates, router=None, user=None, chat_type=None,
+                      on_wait=None, wait_for_quota=False, cancel=None, **kwargs):
+    """Run a chat completion on the selected model, or route it when Auto is selected.
+
+    When user is given, the call is checked against the user's quota (raising
+    QuotaExceeded, or waiting if wait_for_quota until the cancel Event is set)
+    and queued fairly with other users.
+    """
+    router = router or get_model_router()
+    if user is None:
+        return _route_completion(router, model, candidates, chat_type, kwargs)
+    
+    estimated = estimate_request_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+    get_admission_controller().admit(user['user_id'], estimated, wait=wait_for_quota, cancel=cancel)
+    
+    def reserve(blocking=True):
+        # One fair-queue slot per actual API call, held until that call finishes
+        return get_fair_queue().reserve(
+            user['user_id'],
+            cost=estimated,
+            weight=LLM_USER_WEIGHTS.get(user['username'], 1.0),
+            on_wait=on_wait,
+            blocking=blocking
+        )
+    
+    response, used_model = _route_completion(router, model, candidates, chat_type, kwargs, reserve)
+    
+    usage = getattr(response, "usage", None)
+    get_admission_controller().record_usage(
+        user['user_id'], chat_type, used_model, estimated, getattr(usage, "total_tokens", None)
+    )
+    return response, used_model
+
+def _route_completion(router, model, candidates, chat_type, kwargs, reserve=None):
+    if model == AUTO_MODEL:
+        return router.complete(client, candidates, request_type=chat_type, reserve=reserve, **kwargs)
+    return router.call(client, model, kwargs, reserve() if reserve else None), model
+
+# Document summarisation (map-reduce)
+SUMMARY_CHUNK_TOKENS = 3000     # Max input tokens per map/reduce call
+SUMMARY_MAX_TOKENS = 512        # Max output tokens per partial summary
+SUMMARY_WORKERS = 4             # Concurrent summarisation calls per process
+SUMMARY_REFRESH_SECONDS = 2     # How often a running job's progress is redrawn
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", os.path.join(".cache", "summaries"))
+
+MAP_PROMPT = """Summarise the following section of a document. Keep key facts, names, numbers and conclusions.
+
+SECTION:
+{text}
+
+SUMMARY:"""
+
+REDUCE_PROMPT = """Combine the following partial summaries of one document into a single coherent summary.
+Remove repetition but keep all key facts, names, numbers and conclusions.
+
+PARTIAL SUMMARIES:
+{text}
+
+COMBINED SUMMARY:"""
+
+class SummaryCancelled(Exception):
+    """Raised inside a summary job when it has been stopped"""
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def split_into_chunks(text, max_tokens=SUMMARY_CHUNK_TOKENS):
+    """Split text on line boundaries into chunks of at most max_tokens"""
+    max_chars = max_tokens * 4
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            chunks.append(current)
+            chunks.append(line[:max_chars])
+            current = ""
+            line = line[max_chars:]
+        if len(current) + len(line) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += line
+    chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def document_hash(text):
+    """Content hash used to key cached document results"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class SummaryJobManager:
+    """Run map-reduce document summaries in background threads with on-disk partial results"""
+
+    def __init__(self, cache_dir=SUMMARY_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, doc_hash):
+        return os.path.join(self.cache_dir, f"{doc_hash}.json")
+
+    def load_partials(self, doc_hash):
+        try:
+            with open(self._cache_path(doc_hash), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_partial(self, job, key, value):
+        with self.lock:
+            job["partials"][key] = value
+            path = self._cache_path(job["doc_hash"])
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(job["partials"], f)
+            os.replace(path + ".tmp", path)
+
+    def status(self, doc_hash):
+        """Current job state, falling back to cached results from earlier runs"""
+        with self.lock:
+            job = self.jobs.get(doc_hash)
+            if job:
+                return {k: job[k] for k in ("state", "stage", "done", "total", "result", "error")}
+        partials = self.load_partials(doc_hash)
+        if "final" in partials:
+            return {"state": "done", "stage": "final", "done": 1, "total": 1, "result": partials["final"], "error": None}
+        if partials:
+            return {"state": "interrupted", "stage": None, "done": len(partials), "total": None, "result": None, "error": None}
+        return None
+
+    def start(self, doc_hash, text, complete):
+        """Start (or resume) summarising text.
+
+        complete(prompt, cancel) must return the model's reply; cancel is an Event
+        set when the job is stopped, so the call can give up while it waits.
+        """
+        with self.lock:
+            previous = self.jobs.get(doc_hash)
+            if previous and previous["state"] == "running":
+                return
+            # Reuse a stopped run's partials: its in-flight calls may still finish and
+            # save into them, so both runs write one dict instead of racing on the file
+            partials = previous["partials"] if previous else {}
+            partials.update(self.load_partials(doc_hash))
+            job = {
+                "doc_hash": doc_hash,
+                "state": "running",
+                "stage": "map",
+                "done": 0,
+                "total": 0,
+                "result": None,
+                "error": None,
+                "cancel": threading.Event(),
+                "partials": partials
+            }
+            self.jobs[doc_hash] = job
+        threading.Thread(
+            target=self._run,
+            args=(job, text, complete),
+            name=f"summary-{doc_hash[:8]}",
+            daemon=True
+        ).start()
+
+    def cancel(self, doc_hash):
+        with self.lock:
+            job = self.jobs.get(doc_hash)
+            if job:
+                job["cancel"].set()
+
+    def _run(self, job, text, complete):
+        try:
+            summaries = self._run_level(job, "map", split_into_chunks(text), MAP_PROMPT, complete)
+            level = 0
+            while len(summaries) > 1:
+                level += 1
+                groups = split_into_chunks("\n\n".join(summaries))
+                if len(groups) >= len(summaries):
+                    # Summaries too long to pack together; pair them up instead
+                    groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+                summaries = self._run_level(job, f"reduce{level}", groups, REDUCE_PROMPT, complete)
+            result = summaries[0] if summaries else ""
+            self._save_partial(job, "final", result)
+            with self.lock:
+                job["state"] = "done"
+                job["stage"] = "final"
+                job["result"] = result
+        except SummaryCancelled:
+            with self.lock:
+                job["state"] = "interrupted"
+        except Exception as e:
+            job["cancel"].set()
+            with self.lock:
+                job["state"] = "error"
+                job["error"] = str(e)
+
+    def _run_level(self, job, stage, texts, prompt, complete):
+        """Summarise texts concurrently, reusing cached partials for this stage"""
+        keys = [f"{stage}:{i}" for i in range(len(texts))]
+        with self.lock:
+            job["stage"] = stage
+            job["total"] += len(texts)
+            job["done"] += sum(1 for key in keys if key in job["partials"])
+        futures = {}
+        for key, chunk in zip(keys, texts):
+            if key not in job["partials"]:
+                futures[self.executor.submit(self._summarise, job, prompt.format(text=chunk), complete)] = key
+        for future in as_completed(futures):
+            self._save_partial(job, futures[future], future.result())
+            with self.lock:
+                job["done"] += 1
+        return [job["partials"][key] for key in keys]
+
+    def _summarise(self, job, prompt, complete):
+        if job["cancel"].is_set():
+            raise SummaryCancelled()
+        try:
+            return complete(prompt, job["cancel"])
+        except QuotaExceeded:
+            # Stopped while waiting for the user's quota to refill
+            if job["cancel"].is_set():
+                raise SummaryCancelled()
+            raise
+
+@st.cache_resource
+def get_summary_jobs():
+    return SummaryJobManager()
+
+@st.fragment(run_every=SUMMARY_REFRESH_SECONDS)
+def show_summary_progress(summary_jobs, doc_hash):
+    """Progress of a running summary job; re-renders on a timer while the job runs"""
+    summary_status = summary_jobs.status(doc_hash)
+    if not summary_status or summary_status["state"] != "running":
+        # Finished, stopped or failed: rerun the page to show the outcome
+        st.rerun()
+    total = summary_status["total"] or 1
+    st.progress(
+        min(summary_status["done"] / total, 1.0),
+        text=f"⏳ {summary_status['stage']}: {summary_status['done']}/{summary_status['total']} parts"
+    )
+    if st.button("⏹️ Stop", use_container_width=True):
+        summary_jobs.cancel(doc_hash)
+        st.rerun()
+
+# Session state store (SESSION_STORE=sqlite shares state between replicas)
+SESSION_KEYS = ["messages", "pdf_messages", "image_messages", "pdf_text", "pdf_source", "current_image"]
+
+@st.cache_resource
+def get_blob_store():
+    return BlobStore()
+
+@st.cache_resource
+def get_session_store():
+    return create_session_store(get_blob_store())
+
+# Prepared history exports
+EXPORT_TTL_SECONDS = 3600       # Exports left behind by sessions that never logged out are deleted after this
+
+@st.cache_resource
+def get_export_dir():
+    """Per-process directory for prepared exports, removed when the process exits"""
+    path = tempfile.mkdtemp(prefix="chat-exports-")
+    atexit.register(shutil.rmtree, path, True)
+    return path
+
+def remove_stale_exports(directory, max_age=EXPORT_TTL_SECONDS):
+    """Delete prepared exports older than max_age seconds"""
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
 # Initialize database and client
 if 'db_initialized' not in st.session_state:
     st.session_state.db_initialized = init_database()
@@ -376,8 +706,8 @@ def show_login_page():
     with tab1:
         st.markdown("### Login to Your Account")
         with st.form("login_form"):
-            username = st.text_input("👤 Username")
-            password = st.text_input("🔒 Password", type="password")
+            username = st.text_input("👤 Username", key="login_username")
+            password = st.text_input("🔒 Password", type="password", key="login_password")
             submit = st.form_submit_button("🚀 Login", use_container_width=True)
             
             if submit:
@@ -396,10 +726,10 @@ def show_login_page():
     with tab2:
         st.markdown("### Create New Account")
         with st.form("register_form"):
-            new_username = st.text_input("👤 Username")
-            new_email = st.text_input("📧 Email")
-            new_password = st.text_input("🔒 Password", type="password")
-            confirm_password = st.text_input("🔒 Confirm Password", type="password")
+            new_username = st.text_input("👤 Username", key="register_username")
+            new_email = st.text_input("📧 Email", key="register_email")
+            new_password = st.text_input("🔒 Password", type="password", key="register_password")
+            confirm_password = st.text_input("🔒 Confirm Password", type="password", key="register_confirm")
             register = st.form_submit_button("📝 Register", use_container_width=True)
             
             if register:
@@ -429,6 +759,9 @@ if not st.session_state.authenticated:
 
 # Main App (shown only when authenticated)
 user = st.session_state.user
+session_store = get_session_store()
+blob_store = get_blob_store()
+state_id = f"user:{user['user_id']}"
 
 # Header
 st.title("🤖 AI Assistant")
@@ -436,6 +769,63 @@ st.caption(f"Powered by Groq • Logged in as: **{user['username']}**")
 st.markdown("---")
 
 # Helper functions
+def load_state(key, loader=None):
+    """Load a state key on first use: session cache, then shared store, then loader"""
+    if key not in st.session_state:
+        value = session_store.get(state_id, key, MISSING)
+        if value is MISSING:
+            value = loader() if loader else None
+            if value is not None:
+                session_store.set(state_id, key, value)
+        st.session_state[key] = value
+    return st.session_state[key]
+
+def save_state(key, value):
+    """Update a state key in this session and in the shared store"""
+    st.session_state[key] = value
+    session_store.set(state_id, key, value)
+
+def append_state(key, item):
+    """Append to a list in the shared store; the session also picks up turns added by other tabs/replicas"""
+    # Seed from this session if the store no longer has the list (e.g. it expired while idle)
+    st.session_state[key] = session_store.append(state_id, key, item, initial=st.session_state.get(key) or [])
+
+def load_blob_state(key, sent_as_base64=False):
+    """Blob handle for a large value: session cache, then shared store (loaded into the blob store)"""
+    if key not in st.session_state:
+        data = session_store.get_blob(state_id, key)
+        st.session_state[key] = (
+            blob_store.put(data, owner=(state_id, key), sent_as_base64=sent_as_base64) if data is not None else None
+        )
+    return st.session_state[key]
+
+def save_blob_state(key, data, sent_as_base64=False):
+    """Store a large value once per process; the session keeps only its handle"""
+    handle = blob_store.put(data, owner=(state_id, key), sent_as_base64=sent_as_base64)
+    if handle != st.session_state.get(key):
+        session_store.set_blob(state_id, key, data)
+        st.session_state[key] = handle
+    return handle
+
+def discard_export_file():
+    """Delete this session's prepared export file, if any"""
+    export_file = st.session_state.pop("export_file", None)
+    if export_file and os.path.exists(export_file["path"]):
+        os.remove(export_file["path"])
+
+def read_export_file(path):
+    """Deferred download data: the export is read only when the user clicks Download"""
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+def queue_status_callback(placeholder):
+    """on_wait callback that shows the caller's place in the shared LLM queue"""
+    def show(position, eta):
+        placeholder.info(f"🚦 Waiting for a free slot: position {position} in queue • ~{eta:.0f}s")
+    return show
+
 def read_pdf(file):
     try:
         reader = PdfReader(file)
@@ -463,9 +853,8 @@ def encode_image(image_file):
         
         buffered = BytesIO()
         img.save(buffered, format="JPEG", quality=85)
-        img_bytes = buffered.getvalue()
-        encoded = base64.b64encode(img_bytes).decode('utf-8')
-        return encoded, img
+        # Raw JPEG bytes; base64 is only produced when a request is sent
+        return buffered.getvalue(), img
     except Exception as e:
         st.error(f"❌ Error encoding image: {str(e)}")
         return None, None
@@ -478,6 +867,12 @@ with st.sidebar:
     if st.button("🚪 Logout", use_container_width=True):
         st.session_state.authenticated = False
         st.session_state.user = None
+        discard_export_file()
+        # Drop this user's cached state; it stays in the shared store for next login.
+        # Blob references are per user, not per session, so they are kept as well
+        # (another tab may still use them) and are released when replaced.
+        for key in SESSION_KEYS:
+            st.session_state.pop(key, None)
         st.rerun()
     
     st.markdown("---")
@@ -495,21 +890,125 @@ with st.sidebar:
     # Model selector
     st.markdown("### ⚙️ Settings")
     if feature == "🖼️ Image Q&A":
+        candidate_models = VISION_MODELS
         model = st.selectbox(
             "Vision Model:",
-            ["meta-llama/llama-4-maverick-17b-128e-instruct", "meta-llama/llama-4-scout-17b-16e-instruct"],
-            index=0,
-            help="Vision models for image analysis"
+            [AUTO_MODEL] + VISION_MODELS,
+            index=1,
+            help="Vision models for image analysis. Auto routes to the fastest healthy model."
         )
     else:
+        candidate_models = TEXT_MODELS
         model = st.selectbox(
             "AI Model:",
-            ["llama-3.3-70b-versatile", "llama-3.1-70b-versatile", "mixtral-8x7b-32768"],
-            index=0
+            [AUTO_MODEL] + TEXT_MODELS,
+            index=1,
+            help="Auto routes to the fastest healthy model, with hedging and failover."
         )
     
     temperature = st.slider("Temperature:", 0.0, 1.0, 0.7, 0.1)
     
+    queue_load = get_fair_queue().snapshot()
+    st.caption(
+        f"🚦 AI calls in progress: {queue_load['active']}/{queue_load['max_concurrency']} • "
+        f"waiting: {queue_load['waiting']}"
+    )
+    
+    if model == AUTO_MODEL:
+        with st.expander("📊 Routing Metrics", expanded=False):
+            model_stats, route_metrics = get_model_router().snapshot(candidate_models)
+            st.dataframe(model_stats, hide_index=True, use_container_width=True)
+            st.caption(
+                f"Routed: {route_metrics['routed']} • Hedges: {route_metrics['hedges_fired']} "
+                f"(won {route_metrics['hedge_wins']}) • Failovers: {route_metrics['failovers']} • "
+                f"Saved: {route_metrics['seconds_saved']:.1f}s"
+            )
+            last = route_metrics["last_decision"]
+            if last:
+                st.caption(
+                    f"Last: {last['primary']} → served by {last['served_by'] or 'none'}"
+                    f"{' (hedged)' if last['hedged_to'] else ''} in {last['seconds']}s"
+                )
+    
+    st.markdown("---")
+    
+    with st.expander("🧮 Shared Documents", expanded=False):
+        blob_stats = blob_store.stats()
+        st.caption(
+            f"Blobs: {blob_stats['blobs']} ({blob_stats['references']} refs) • "
+            f"In memory: {blob_stats['resident_bytes'] / 2 ** 20:.1f} MB • "
+            f"On disk: {blob_stats['spilled_bytes'] / 2 ** 20:.1f} MB"
+        )
+        st.caption(
+            f"Saved by dedup: {blob_stats['dedup_saved_bytes'] / 2 ** 20:.1f} MB • "
+            f"Saved vs base64: {blob_stats['base64_saved_bytes'] / 2 ** 20:.1f} MB • "
+            f"Evictions: {blob_stats['evictions']} • Disk reads: {blob_stats['disk_reads']}"
+        )
+    
+    # Full history export (streamed from the database into a temp file)
+    with st.expander("📦 Export History", expanded=False):
+        remove_stale_exports(get_export_dir())
+        export_format = st.selectbox(
+            "Format:",
+            list(EXPORT_FORMATS),
+            format_func=lambda f: {"jsonl": "JSONL", "markdown": "Markdown"}[f]
+        )
+        export_gzip = st.checkbox("🗜️ gzip-compress")
+        export_types = st.multiselect("Chat types:", CHAT_TYPES, default=CHAT_TYPES)
+        export_dates = ()
+        if st.checkbox("📅 Limit to date range"):
+            export_dates = st.date_input("Date range:", value=(date.today() - timedelta(days=30), date.today()))
+        
+        if st.button("📦 Prepare Export", use_container_width=True, disabled=not export_types):
+            discard_export_file()
+            
+            extension, mime = export_file_info(export_format, export_gzip)
+            connection = get_database_connection()
+            if connection:
+                export_path = None
+                try:
+                    with tempfile.NamedTemporaryFile(
+                        "wb", suffix=f".{extension}", dir=get_export_dir(), delete=False
+                    ) as out:
+                        export_path = out.name
+                        size = write_export(
+                            connection,
+                            user['user_id'],
+                            out,
+                            fmt=export_format,
+                            compress=export_gzip,
+                            chat_types=export_types,
+                            start=export_dates[0] if export_dates else None,
+                            end=export_dates[1] if len(export_dates) == 2 else None,
+                            username=user['username']
+                        )
+                    st.session_state.export_file = {
+                        "path": out.name,
+                        "name": f"chat_history_{user['username']}.{extension}",
+                        "mime": mime,
+                        "size": size
+                    }
+                    export_path = None
+                except Error as e:
+                    st.error(f"❌ Export failed: {e}")
+                finally:
+                    # A failed export leaves a partial file behind
+                    if export_path and os.path.exists(export_path):
+                        os.remove(export_path)
+                    if connection.is_connected():
+                        connection.close()
+        
+        export_file = st.session_state.get("export_file")
+        if export_file and os.path.exists(export_file["path"]):
+            st.caption(f"Ready: {export_file['size'] / 1024:.1f} KB")
+            st.download_button(
+                label="💾 Download Export",
+                data=read_export_file(export_file["path"]),
+                file_name=export_file["name"],
+                mime=export_file["mime"],
+                use_container_width=True
+            )
+    
     st.markdown("---")
     st.markdown("### 💡 Tips")
     st.info("💬 **Chat**: Your conversations are saved!\n\n📄 **PDF**: Upload & analyze documents\n\n🖼️ **Image**: AI-powered vision analysis")
@@ -518,16 +1017,14 @@ with st.sidebar:
 if feature == "💬 Chat Assistant":
     st.markdown("### 💬 Chat with AI")
     
-    # Load chat history from database
-    if "messages_loaded" not in st.session_state:
-        st.session_state.messages = load_chat_history(user['user_id'], 'chat')
-        st.session_state.messages_loaded = True
+    # Load chat history (shared store first, database on a cold start)
+    load_state("messages", lambda: load_chat_history(user['user_id'], 'chat'))
     
     col1, col2, col3 = st.columns([1, 1, 4])
     with col1:
         if st.button("🗑️ Clear Chat"):
             if clear_chat_history(user['user_id'], 'chat'):
-                st.session_state.messages = []
+                save_state("messages", [])
                 st.success("✅ Chat cleared!")
                 st.rerun()
     with col2:
@@ -548,17 +1045,22 @@ if feature == "💬 Chat Assistant":
     
     if prompt := st.chat_input("💭 Type your message here..."):
         # Add user message
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        append_state("messages", {"role": "user", "content": prompt})
         save_chat_message(user['user_id'], 'chat', 'user', prompt)
         
         with st.chat_message("user"):
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
+            queue_status = st.empty()
             with st.spinner("🤔 Thinking..."):
                 try:
-                    response = client.chat.completions.create(
-                        model=model,
+                    response, used_model = create_completion(
+                        model,
+                        candidate_models,
+                        user=user,
+                        chat_type='chat',
+                        on_wait=queue_status_callback(queue_status),
                         messages=[
                             {"role": "system", "content": "You are a helpful, friendly, and knowledgeable AI assistant."},
                             *st.session_state.messages
@@ -566,13 +1068,19 @@ if feature == "💬 Chat Assistant":
                         temperature=temperature,
                         max_tokens=2048
                     )
+                    queue_status.empty()
                     ai_response = response.choices[0].message.content
                     st.markdown(ai_response)
+                    if model == AUTO_MODEL:
+                        st.caption(f"⚡ Answered by {used_model}")
                     
                     # Save assistant response
-                    st.session_state.messages.append({"role": "assistant", "content": ai_response})
+                    append_state("messages", {"role": "assistant", "content": ai_response})
                     save_chat_message(user['user_id'], 'chat', 'assistant', ai_response)
+                except QuotaExceeded as e:
+                    st.warning(f"⏳ {e}")
                 except Exception as e:
+                    queue_status.empty()
                     st.error(f"❌ Error: {str(e)}")
 
 # Feature 2: PDF Analyzer
@@ -595,64 +1103,126 @@ elif feature == "📄 PDF Analyzer":
             st.success(f"**{uploaded_pdf.name}**")
             st.caption(f"Size: {uploaded_pdf.size / 1024:.2f} KB")
     
+    pdf_text = None
     if uploaded_pdf:
-        with st.spinner("📖 Reading PDF..."):
-            pdf_text = read_pdf(uploaded_pdf)
-        
-        if pdf_text:
-            st.session_state.pdf_text = pdf_text
-            
-            with st.expander("📖 View Document Preview", expanded=False):
-                preview_text = pdf_text[:2000] + "..." if len(pdf_text) > 2000 else pdf_text
-                st.text_area(
-                    "Content Preview:",
-                    preview_text,
-                    height=300,
-                    disabled=True
-                )
-            
-            st.markdown("---")
-            st.markdown("#### 🔍 Ask Questions")
-            
-            # Load PDF chat history
-            if "pdf_messages_loaded" not in st.session_state:
-                st.session_state.pdf_messages = load_chat_history(user['user_id'], 'pdf')
-                st.session_state.pdf_messages_loaded = True
-            
-            # Display previous Q&A
-            for msg in st.session_state.pdf_messages:
-                if msg['role'] == 'user':
-                    st.markdown(f"""
-                        <div class="qa-container">
-                            <div class="qa-question">❓ Question: {msg['content']}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.markdown(f"""
-                        <div class="qa-container">
-                            <div class="qa-answer">💡 Answer: {msg['content']}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-            
-            question = st.text_input("💭 What would you like to know about this document?", key="pdf_question")
+        pdf_source = content_hash(uploaded_pdf.getvalue())
+        if pdf_source == load_state("pdf_source"):
+            # Same file as last time: reuse the extracted text instead of parsing it again
+            pdf_text = blob_store.text(load_blob_state("pdf_text"))
+        if not pdf_text:
+            with st.spinner("📖 Reading PDF..."):
+                pdf_text = read_pdf(uploaded_pdf)
             
-            col1, col2 = st.columns([1, 4])
-            with col1:
-                ask_button = st.button("🔍 Get Answer", use_container_width=True, type="primary")
+            if pdf_text:
+                save_blob_state("pdf_text", pdf_text)
+                save_state("pdf_source", pdf_source)
+            else:
+                st.warning("⚠️ Could not extract text from PDF.")
+    else:
+        pdf_text = blob_store.text(load_blob_state("pdf_text"))
+        if pdf_text:
             with col2:
-                if st.button("🗑️ Clear History", use_container_width=True):
-                    if clear_chat_history(user['user_id'], 'pdf'):
-                        st.session_state.pdf_messages = []
-                        st.success("✅ History cleared!")
-                        st.rerun()
-            
-            if ask_button and question:
-                with st.spinner("🤖 Analyzing document..."):
-                    try:
-                        text_limit = 15000
-                        truncated_text = pdf_text[:text_limit]
-                        
-                        prompt = f"""Based on the document below, provide a clear and concise answer to the question.
+                st.markdown("#### ✅ Document Loaded")
+                st.caption("📎 Continuing with your previously loaded document")
+        else:
+            st.info("👆 Upload a PDF document to get started!")
+    
+    if pdf_text:
+        with st.expander("📖 View Document Preview", expanded=False):
+            preview_text = pdf_text[:2000] + "..." if len(pdf_text) > 2000 else pdf_text
+            st.text_area(
+                "Content Preview:",
+                preview_text,
+                height=300,
+                disabled=True
+            )
+
+        # Whole-document summary (runs in the background)
+        st.markdown("---")
+        st.markdown("#### 📝 Document Summary")
+        summary_jobs = get_summary_jobs()
+        doc_hash = document_hash(pdf_text)
+        summary_status = summary_jobs.status(doc_hash)
+
+        if summary_status and summary_status["state"] == "done":
+            with st.expander("📝 Summary", expanded=True):
+                st.markdown(summary_status["result"])
+        elif summary_status and summary_status["state"] == "running":
+            show_summary_progress(summary_jobs, doc_hash)
+        else:
+            if summary_status and summary_status["state"] == "error":
+                st.error(f"❌ Summary failed: {summary_status['error']}")
+            elif summary_status and summary_status["state"] == "interrupted":
+                st.info(f"⏸️ Summary paused with {summary_status['done']} parts saved. It will resume from there.")
+
+            st.caption(f"~{len(split_into_chunks(pdf_text))} sections will be summarised and combined.")
+            if st.button("📝 Summarise document", use_container_width=True):
+                router = get_model_router()
+
+                def complete_summary(prompt, cancel, model=model, candidates=candidate_models, owner=dict(user)):
+                    def stop_if_cancelled(position, eta):
+                        if cancel.is_set():
+                            raise SummaryCancelled()
+                    
+                    response, _ = create_completion(
+                        model,
+                        candidates,
+                        router=router,
+                        user=owner,
+                        chat_type='summary',
+                        on_wait=stop_if_cancelled,
+                        wait_for_quota=True,
+                        cancel=cancel,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.3,
+                        max_tokens=SUMMARY_MAX_TOKENS
+                    )
+                    return response.choices[0].message.content
+
+                summary_jobs.start(doc_hash, pdf_text, complete_summary)
+                st.rerun()
+
+        st.markdown("---")
+        st.markdown("#### 🔍 Ask Questions")
+        
+        # Load PDF chat history
+        load_state("pdf_messages", lambda: load_chat_history(user['user_id'], 'pdf'))
+        
+        # Display previous Q&A
+        for msg in st.session_state.pdf_messages:
+            if msg['role'] == 'user':
+                st.markdown(f"""
+                    <div class="qa-container">
+                        <div class="qa-question">❓ Question: {msg['content']}</div>
+                    </div>
+                """, unsafe_allow_html=True)
+            else:
+                st.markdown(f"""
+                    <div class="qa-container">
+                        <div class="qa-answer">💡 Answer: {msg['content']}</div>
+                    </div>
+                """, unsafe_allow_html=True)
+        
+        question = st.text_input("💭 What would you like to know about this document?", key="pdf_question")
+        
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            ask_button = st.button("🔍 Get Answer", use_container_width=True, type="primary")
+        with col2:
+            if st.button("🗑️ Clear History", use_container_width=True):
+                if clear_chat_history(user['user_id'], 'pdf'):
+                    save_state("pdf_messages", [])
+                    st.success("✅ History cleared!")
+                    st.rerun()
+        
+        if ask_button and question:
+            queue_status = st.empty()
+            with st.spinner("🤖 Analyzing document..."):
+                try:
+                    text_limit = 15000
+                    truncated_text = pdf_text[:text_limit]
+                    
+                    prompt = f"""Based on the document below, provide a clear and concise answer to the question.
 If the answer is not in the document, say "I cannot find this information in the document."
 
 DOCUMENT:
@@ -661,32 +1231,35 @@ DOCUMENT:
 QUESTION: {question}
 
 ANSWER:"""
-                        
-                        response = client.chat.completions.create(
-                            model=model,
-                            messages=[{"role": "user", "content": prompt}],
-                            temperature=0.3,
-                            max_tokens=1024
-                        )
-                        
-                        answer = response.choices[0].message.content
-                        
-                        # Save to database
-                        save_chat_message(user['user_id'], 'pdf', 'user', question)
-                        save_chat_message(user['user_id'], 'pdf', 'assistant', answer)
-                        
-                        # Update session state
-                        st.session_state.pdf_messages.append({"role": "user", "content": question})
-                        st.session_state.pdf_messages.append({"role": "assistant", "content": answer})
-                        
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
-        else:
-            st.warning("⚠️ Could not extract text from PDF.")
-    else:
-        st.info("👆 Upload a PDF document to get started!")
+                    
+                    response, used_model = create_completion(
+                        model,
+                        candidate_models,
+                        user=user,
+                        chat_type='pdf',
+                        on_wait=queue_status_callback(queue_status),
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.3,
+                        max_tokens=1024
+                    )
+                    
+                    answer = response.choices[0].message.content
+                    
+                    # Save to database
+                    save_chat_message(user['user_id'], 'pdf', 'user', question)
+                    save_chat_message(user['user_id'], 'pdf', 'assistant', answer)
+                    
+                    # Update session state
+                    append_state("pdf_messages", {"role": "user", "content": question})
+                    append_state("pdf_messages", {"role": "assistant", "content": answer})
+                    
+                    st.rerun()
+                    
+                except QuotaExceeded as e:
+                    st.warning(f"⏳ {e}")
+                except Exception as e:
+                    queue_status.empty()
+                    st.error(f"❌ Error: {str(e)}")
 
 # Feature 3: Image Q&A
 elif feature == "🖼️ Image Q&A":
@@ -702,112 +1275,129 @@ elif feature == "🖼️ Image Q&A":
             help="Upload an image to analyze"
         )
     
+    image_handle = None
     if uploaded_image:
         with col2:
             st.markdown("#### 🖼️ Preview")
-            encoded_image, display_img = encode_image(uploaded_image)
+            image_bytes, display_img = encode_image(uploaded_image)
             
             if display_img:
                 st.image(display_img, use_container_width=True)
                 st.caption(f"Size: {display_img.size[0]}x{display_img.size[1]} pixels")
-                st.session_state.current_image = encoded_image
-        
-        if encoded_image:
-            st.markdown("---")
-            st.markdown("#### 💭 Ask About the Image")
-            
-            # Load image chat history
-            if "image_messages_loaded" not in st.session_state:
-                st.session_state.image_messages = load_chat_history(user['user_id'], 'image')
-                st.session_state.image_messages_loaded = True
-            
-            # Display previous Q&A
-            for msg in st.session_state.image_messages:
-                if msg['role'] == 'user':
-                    st.markdown(f"""
-                        <div class="qa-container">
-                            <div class="qa-question">❓ Question: {msg['content']}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.markdown(f"""
-                        <div class="qa-container">
-                            <div class="qa-answer">💡 Response: {msg['content']}</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-            
-            # Quick actions
-            st.markdown("**Quick Actions:**")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                if st.button("🔍 Describe", use_container_width=True):
-                    st.session_state.quick_question = "Describe this image in detail."
-            with col2:
-                if st.button("🏷️ Objects", use_container_width=True):
-                    st.session_state.quick_question = "What objects can you see?"
-            with col3:
-                if st.button("📝 Text", use_container_width=True):
-                    st.session_state.quick_question = "Extract any text from this image."
-            
-            default_question = st.session_state.get("quick_question", "")
-            question = st.text_input(
-                "💭 What would you like to know?",
-                value=default_question,
-                placeholder="e.g., What's in this image?",
-                key="image_question"
-            )
-            
-            if "quick_question" in st.session_state:
-                del st.session_state.quick_question
-            
-            col1, col2 = st.columns([1, 4])
-            with col1:
-                analyze_button = st.button("🔍 Analyze", use_container_width=True, type="primary")
+                image_handle = save_blob_state("current_image", image_bytes, sent_as_base64=True)
+    else:
+        image_handle = load_blob_state("current_image", sent_as_base64=True)
+        image_bytes = blob_store.get(image_handle)
+        if image_bytes:
             with col2:
-                if st.button("🗑️ Clear History", use_container_width=True):
-                    if clear_chat_history(user['user_id'], 'image'):
-                        st.session_state.image_messages = []
-                        st.success("✅ History cleared!")
-                        st.rerun()
-            
-            if analyze_button and question:
-                with st.spinner("🤖 Analyzing image..."):
-                    try:
-                        response = client.chat.completions.create(
-                            model=model,
-                            messages=[
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": question},
-                                        {
-                                            "type": "image_url",
-                                            "image_url": {
-                                                "url": f"data:image/jpeg;base64,{st.session_state.current_image}"
-                                            }
+                st.markdown("#### 🖼️ Preview")
+                st.image(image_bytes, use_container_width=True)
+                st.caption("📎 Continuing with your previously uploaded image")
+        else:
+            image_handle = None
+    
+    if image_handle:
+        st.markdown("---")
+        st.markdown("#### 💭 Ask About the Image")
+        
+        # Load image chat history
+        load_state("image_messages", lambda: load_chat_history(user['user_id'], 'image'))
+        
+        # Display previous Q&A
+        for msg in st.session_state.image_messages:
+            if msg['role'] == 'user':
+                st.markdown(f"""
+                    <div class="qa-container">
+                        <div class="qa-question">❓ Question: {msg['content']}</div>
+                    </div>
+                """, unsafe_allow_html=True)
+            else:
+                st.markdown(f"""
+                    <div class="qa-container">
+                        <div class="qa-answer">💡 Response: {msg['content']}</div>
+                    </div>
+                """, unsafe_allow_html=True)
+        
+        # Quick actions
+        st.markdown("**Quick Actions:**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("🔍 Describe", use_container_width=True):
+                st.session_state.quick_question = "Describe this image in detail."
+        with col2:
+            if st.button("🏷️ Objects", use_container_width=True):
+                st.session_state.quick_question = "What objects can you see?"
+        with col3:
+            if st.button("📝 Text", use_container_width=True):
+                st.session_state.quick_question = "Extract any text from this image."
+        
+        default_question = st.session_state.get("quick_question", "")
+        question = st.text_input(
+            "💭 What would you like to know?",
+            value=default_question,
+            placeholder="e.g., What's in this image?",
+            key="image_question"
+        )
+        
+        if "quick_question" in st.session_state:
+            del st.session_state.quick_question
+        
+        col1, col2 = st.columns([1, 4])
+        with col1:
+            analyze_button = st.button("🔍 Analyze", use_container_width=True, type="primary")
+        with col2:
+            if st.button("🗑️ Clear History", use_container_width=True):
+                if clear_chat_history(user['user_id'], 'image'):
+                    save_state("image_messages", [])
+                    st.success("✅ History cleared!")
+                    st.rerun()
+        
+        if analyze_button and question:
+            queue_status = st.empty()
+            with st.spinner("🤖 Analyzing image..."):
+                try:
+                    response, used_model = create_completion(
+                        model,
+                        candidate_models,
+                        user=user,
+                        chat_type='image',
+                        on_wait=queue_status_callback(queue_status),
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": [
+                                    {"type": "text", "text": question},
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {
+                                            "url": f"data:image/jpeg;base64,{blob_store.b64(image_handle)}"
                                         }
-                                    ]
-                                }
-                            ],
-                            temperature=temperature,
-                            max_tokens=1024
-                        )
-                        
-                        answer = response.choices[0].message.content
-                        
-                        # Save to database
-                        save_chat_message(user['user_id'], 'image', 'user', question)
-                        save_chat_message(user['user_id'], 'image', 'assistant', answer)
-                        
-                        # Update session state
-                        st.session_state.image_messages.append({"role": "user", "content": question})
-                        st.session_state.image_messages.append({"role": "assistant", "content": answer})
-                        
-                        st.rerun()
-                        
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
-    else:
+                                    }
+                                ]
+                            }
+                        ],
+                        temperature=temperature,
+                        max_tokens=1024
+                    )
+                    
+                    answer = response.choices[0].message.content
+                    
+                    # Save to database
+                    save_chat_message(user['user_id'], 'image', 'user', question)
+                    save_chat_message(user['user_id'], 'image', 'assistant', answer)
+                    
+                    # Update session state
+                    append_state("image_messages", {"role": "user", "content": question})
+                    append_state("image_messages", {"role": "assistant", "content": answer})
+                    
+                    st.rerun()
+                    
+                except QuotaExceeded as e:
+                    st.warning(f"⏳ {e}")
+                except Exception as e:
+                    queue_status.empty()
+                    st.error(f"❌ Error: {str(e)}")
+    elif not uploaded_image:
         st.info("👆 Upload an image to get started!")
 
 # Footer
@@ -0,0 +1,211 @@
+"""Latency-aware routing across interchangeable models.
+
+ModelRouter keeps rolling latency samples and recent outcomes per model.
+Healthy models are tried first: fastest first for simple requests, the
+configured order (with much slower models moved back) otherwise. A call
+slower than its model's p95 is hedged with a duplicate to the next model,
+and errors fail over down the list. Outcomes expire after
+ROUTER_HEALTH_SECONDS, so a model that was failing gets tried again once
+the burst is over instead of being excluded for good.
+"""
+import contextlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from admission import estimate_request_tokens
+
+ROUTER_WINDOW = 50              # Samples kept per model for percentiles/error rate
+ROUTER_MAX_ERROR_RATE = 0.5     # Models at or above this error rate are unhealthy
+ROUTER_HEALTH_SECONDS = 60      # Outcomes older than this no longer count towards the error rate
+ROUTER_SLOW_FACTOR = 3.0        # For larger requests, models with p95 this many times the best are tried last
+# Requests up to this many text tokens (images not counted) go to the fastest model
+SIMPLE_REQUEST_TOKENS = {
+    "chat": 2000,       # a few turns of history
+    "pdf": 4500,        # the question plus the 15000-character document excerpt
+    "image": 500        # the question alone
+}
+SIMPLE_REQUEST_DEFAULT_TOKENS = 1000
+
+
+def is_simple_request(messages, request_type=None):
+    """Small requests: text over every message sent (history, system prompt), sized per request type"""
+    limit = SIMPLE_REQUEST_TOKENS.get(request_type, SIMPLE_REQUEST_DEFAULT_TOKENS)
+    return estimate_request_tokens(messages, image_tokens=0) <= limit
+
+
+class ModelRouter:
+    """Track rolling latency/error stats per model and route calls with hedging and failover"""
+
+    def __init__(self, window=ROUTER_WINDOW, health_seconds=ROUTER_HEALTH_SECONDS):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.outcomes = {}          # model -> (monotonic time, ok) of recent calls
+        self.window = window
+        self.health_seconds = health_seconds
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm")
+        self.metrics = {
+            "routed": 0,
+            "hedges_fired": 0,
+            "hedge_wins": 0,
+            "failovers": 0,
+            "seconds_saved": 0.0,
+            "last_decision": None
+        }
+
+    def record(self, model, latency, ok):
+        with self.lock:
+            self.outcomes.setdefault(model, deque(maxlen=self.window)).append((time.monotonic(), ok))
+            if ok:
+                self.latencies.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, model, pct):
+        with self.lock:
+            samples = sorted(self.latencies.get(model, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def error_rate(self, model):
+        """Share of failed calls among the model's recent outcomes"""
+        cutoff = time.monotonic() - self.health_seconds
+        with self.lock:
+            outcomes = [ok for at, ok in self.outcomes.get(model, ()) if at >= cutoff]
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def rank(self, candidates, messages, request_type=None):
+        """Order candidates: healthy first; fastest first for simple requests,
+        otherwise the given order with much slower models moved back"""
+        healthy = [m for m in candidates if self.error_rate(m) < ROUTER_MAX_ERROR_RATE]
+        unhealthy = [m for m in candidates if m not in healthy]
+        if is_simple_request(messages, request_type):
+            # Models without samples sort first so they get measured
+            healthy.sort(key=lambda m: self.percentile(m, 50) or 0.0)
+        else:
+            p95 = {m: self.percentile(m, 95) for m in healthy}
+            best = min((v for v in p95.values() if v is not None), default=None)
+            if best is not None:
+                healthy.sort(key=lambda m: p95[m] is not None and p95[m] > ROUTER_SLOW_FACTOR * best)
+        unhealthy.sort(key=self.error_rate)
+        return healthy + unhealthy
+
+    def call(self, client, model, kwargs, held=None):
+        """Single timed completion call that feeds the rolling stats.
+
+        held is an already-acquired concurrency slot, released when the call ends.
+        """
+        with held or contextlib.nullcontext():
+            started = time.monotonic()
+            try:
+                response = client.chat.completions.create(model=model, **kwargs)
+            except Exception:
+                self.record(model, time.monotonic() - started, False)
+                raise
+            self.record(model, time.monotonic() - started, True)
+            return response
+
+    def complete(self, client, candidates, request_type=None, reserve=None, **kwargs):
+        """Route a completion; returns (response, model that served it).
+
+        reserve(blocking) takes a concurrency slot for each call the router makes,
+        so hedges and failovers count against the cap until they actually finish.
+        """
+        order = self.rank(candidates, kwargs["messages"], request_type)
+        remaining = list(order)
+        pending = {}
+        errors = []
+        started = time.monotonic()
+
+        def launch(blocking=True):
+            held = reserve(blocking) if reserve else None
+            if reserve and held is None:
+                return None
+            model = remaining.pop(0)
+            pending[self.executor.submit(self.call, client, model, kwargs, held)] = model
+            return model
+
+        primary = launch()
+        primary_future = next(iter(pending))
+        hedge_after = self.percentile(primary, 95)
+        decision = {
+            "primary": primary,
+            "simple": is_simple_request(kwargs["messages"], request_type),
+            "hedged_to": None,
+            "served_by": None,
+            "failovers": 0
+        }
+
+        while pending:
+            timeout = None
+            if decision["hedged_to"] is None and remaining and hedge_after is not None:
+                timeout = max(0.0, hedge_after - (time.monotonic() - started))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Primary is slower than its p95: fire a duplicate at the next model,
+                # but only if a slot is free - a hedge never queues behind other users
+                decision["hedged_to"] = launch(blocking=False)
+                if decision["hedged_to"] is None:
+                    hedge_after = None
+                else:
+                    self._bump("hedges_fired")
+                continue
+
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+
+                decision["served_by"] = model
+                if decision["hedged_to"] == model:
+                    self._bump("hedge_wins")
+                    self._track_savings(primary_future, time.monotonic())
+                self._finish(decision, time.monotonic() - started)
+                return response, model
+
+            if not pending and remaining:
+                launch()
+                decision["failovers"] += 1
+                self._bump("failovers")
+
+        self._finish(decision, time.monotonic() - started)
+        raise errors[-1]
+
+    def _bump(self, key, amount=1):
+        with self.lock:
+            self.metrics[key] += amount
+
+    def _track_savings(self, primary_future, hedge_finished):
+        """Once the abandoned primary finishes, credit the time the hedge saved"""
+        def credit(future):
+            if future.exception() is None:
+                self._bump("seconds_saved", max(0.0, time.monotonic() - hedge_finished))
+        primary_future.add_done_callback(credit)
+
+    def _finish(self, decision, elapsed):
+        decision["seconds"] = round(elapsed, 2)
+        with self.lock:
+            self.metrics["routed"] += 1
+            self.metrics["last_decision"] = decision
+
+    def snapshot(self, candidates):
+        """Per-model stats plus routing counters for display"""
+        rows = []
+        for m in candidates:
+            p50 = self.percentile(m, 50)
+            p95 = self.percentile(m, 95)
+            rows.append({
+                "model": m,
+                "p50 (s)": round(p50, 2) if p50 is not None else None,
+                "p95 (s)": round(p95, 2) if p95 is not None else None,
+                "error rate": f"{self.error_rate(m):.0%}"
+            })
+        with self.lock:
+            return rows, dict(self.metrics)
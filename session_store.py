@@ -0,0 +1,339 @@
+"""Session-state stores shared by every replica of the app.
+
+Conversation state is kept per session id as JSON values, one row per key,
+so callers can load just the keys they need. Large values (document text,
+images) are stored once as content-addressed blobs and referenced by hash.
+
+Backends:
+    InProcessSessionStore - dicts in this process (single replica); blobs
+                            live in the process-wide BlobStore. Sessions idle
+                            for SESSION_IDLE_SECONDS are dropped
+    SQLiteSessionStore    - a SQLite file shared by replicas on the same host
+                            (WAL needs shared memory; not for network filesystems)
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from blob_store import BlobStore
+
+MISSING = object()
+# In-process backend only: sessions idle this long, or beyond the cap (least recently used first), are dropped
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", str(6 * 3600)))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+
+
+def content_hash(data):
+    """SHA-256 hex digest of bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+class SessionStore(ABC):
+    """Interface for per-session key/value state plus a blob store"""
+
+    @abstractmethod
+    def get(self, session_id, key, default=None):
+        ...
+
+    @abstractmethod
+    def set(self, session_id, key, value):
+        ...
+
+    @abstractmethod
+    def append(self, session_id, key, item, initial=()):
+        """Atomically append item to the list stored at key (starting from initial
+        if there is none); returns the updated list"""
+
+    @abstractmethod
+    def delete(self, session_id, key=None):
+        """Delete one key, or the whole session when key is None"""
+
+    @abstractmethod
+    def set_blob(self, session_id, key, data):
+        """Store bytes/str once by content hash and point key at it; returns the hash"""
+
+    @abstractmethod
+    def get_blob(self, session_id, key, default=None):
+        """Return the bytes/str stored with set_blob, or default"""
+
+    @abstractmethod
+    def stats(self):
+        ...
+
+
+class InProcessSessionStore(SessionStore):
+    """Store backed by dicts in this process; idle sessions expire so memory stays bounded"""
+
+    def __init__(self, blob_store=None, idle_seconds=SESSION_IDLE_SECONDS, max_sessions=SESSION_MAX_SESSIONS):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()   # session_id -> {key: value}, least recently used first
+        self.last_used = {}             # session_id -> monotonic time of last access
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.expired = 0
+        self.blob_store = blob_store or BlobStore()
+
+    def get(self, session_id, key, default=None):
+        with self.lock:
+            value = self.sessions.get(session_id, {}).get(key, MISSING)
+            self._touch(session_id)
+        if value is MISSING or isinstance(value, _BlobRef):
+            return default
+        # Hand out a copy so callers can't mutate stored state in place
+        return json.loads(value)
+
+    def set(self, session_id, key, value):
+        encoded = json.dumps(value)
+        with self.lock:
+            self._replace(session_id, key, encoded)
+            self._touch(session_id)
+
+    def append(self, session_id, key, item, initial=()):
+        with self.lock:
+            current = self.sessions.get(session_id, {}).get(key)
+            items = json.loads(current) if isinstance(current, str) else list(initial)
+            items.append(item)
+            self._replace(session_id, key, json.dumps(items))
+            self._touch(session_id)
+        return items
+
+    def delete(self, session_id, key=None):
+        with self.lock:
+            keys = list(self.sessions.get(session_id, {})) if key is None else [key]
+            for k in keys:
+                self._replace(session_id, k, MISSING)
+            if key is None:
+                self.sessions.pop(session_id, None)
+                self.last_used.pop(session_id, None)
+            else:
+                self._touch(session_id)
+
+    def set_blob(self, session_id, key, data):
+        digest = self.blob_store.put(data, owner=(session_id, key))
+        with self.lock:
+            self._replace(session_id, key, _BlobRef(digest, isinstance(data, str)))
+            self._touch(session_id)
+        return digest
+
+    def get_blob(self, session_id, key, default=None):
+        with self.lock:
+            ref = self.sessions.get(session_id, {}).get(key)
+            self._touch(session_id)
+        if not isinstance(ref, _BlobRef):
+            return default
+        raw = self.blob_store.get(ref.digest)
+        if raw is None:
+            return default
+        return raw.decode("utf-8") if ref.is_text else raw
+
+    def _replace(self, session_id, key, value):
+        """Swap a key's value, releasing a blob it no longer points to (caller holds the lock)"""
+        session = self.sessions.setdefault(session_id, {})
+        old = session.pop(key, None)
+        if value is not MISSING:
+            session[key] = value
+        if isinstance(old, _BlobRef) and not isinstance(value, _BlobRef):
+            self.blob_store.release((session_id, key))
+
+    def _touch(self, session_id):
+        """Mark a session as used and drop idle ones (caller holds the lock)"""
+        if session_id in self.sessions:
+            self.sessions.move_to_end(session_id)
+            self.last_used[session_id] = time.monotonic()
+        cutoff = time.monotonic() - self.idle_seconds
+        while self.sessions:
+            oldest = next(iter(self.sessions))
+            if oldest == session_id or (
+                len(self.sessions) <= self.max_sessions and self.last_used.get(oldest, 0.0) >= cutoff
+            ):
+                break
+            for k in list(self.sessions[oldest]):
+                self._replace(oldest, k, MISSING)
+            del self.sessions[oldest]
+            self.last_used.pop(oldest, None)
+            self.expired += 1
+
+    def stats(self):
+        blob_stats = self.blob_store.stats()
+        with self.lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self.sessions),
+                "expired_sessions": self.expired,
+                "blobs": blob_stats["blobs"],
+                "blob_bytes": blob_stats["resident_bytes"] + blob_stats["spilled_bytes"],
+                "blob_refs": blob_stats["references"]
+            }
+
+
+class _BlobRef:
+    __slots__ = ("digest", "is_text")
+
+    def __init__(self, digest, is_text):
+        self.digest = digest
+        self.is_text = is_text
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store backed by a SQLite file; replicas sharing the file share state"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS session_state (
+                    session_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT,
+                    blob_hash TEXT,
+                    blob_is_text INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_session_blob ON session_state (blob_hash);
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    data BLOB NOT NULL
+                );
+            """)
+
+    def _connection(self):
+        """One connection per thread; WAL lets readers on other replicas proceed during writes"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, session_id, key, default=None):
+        row = self._connection().execute(
+            "SELECT value FROM session_state WHERE session_id = ? AND key = ? AND blob_hash IS NULL",
+            (session_id, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, session_id, key, value):
+        self._write(session_id, key, json.dumps(value), None, False)
+
+    def append(self, session_id, key, item, initial=()):
+        # Read and write under one write lock so concurrent appends from other replicas aren't lost
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT value FROM session_state WHERE session_id = ? AND key = ? AND blob_hash IS NULL",
+                (session_id, key)
+            ).fetchone()
+            items = json.loads(row[0]) if row else list(initial)
+            items.append(item)
+            self._upsert(conn, session_id, key, json.dumps(items), None, False)
+        return items
+
+    def delete(self, session_id, key=None):
+        with self._transaction() as conn:
+            if key is None:
+                rows = conn.execute(
+                    "SELECT blob_hash FROM session_state WHERE session_id = ? AND blob_hash IS NOT NULL",
+                    (session_id,)
+                ).fetchall()
+                conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+            else:
+                rows = conn.execute(
+                    "SELECT blob_hash FROM session_state WHERE session_id = ? AND key = ? AND blob_hash IS NOT NULL",
+                    (session_id, key)
+                ).fetchall()
+                conn.execute("DELETE FROM session_state WHERE session_id = ? AND key = ?", (session_id, key))
+            for (digest,) in rows:
+                self._drop_unreferenced(conn, digest)
+
+    def set_blob(self, session_id, key, data):
+        raw = _to_bytes(data)
+        digest = content_hash(raw)
+        # One transaction, so another replica can't drop the blob before the row points at it
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)", (digest, raw))
+            self._upsert(conn, session_id, key, None, digest, isinstance(data, str))
+        return digest
+
+    def get_blob(self, session_id, key, default=None):
+        row = self._connection().execute(
+            """SELECT b.data, s.blob_is_text FROM session_state s
+               JOIN blobs b ON b.hash = s.blob_hash
+               WHERE s.session_id = ? AND s.key = ?""",
+            (session_id, key)
+        ).fetchone()
+        if not row:
+            return default
+        return bytes(row[0]).decode("utf-8") if row[1] else bytes(row[0])
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database write lock up front"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    def _write(self, session_id, key, value, digest, is_text):
+        with self._transaction() as conn:
+            self._upsert(conn, session_id, key, value, digest, is_text)
+
+    def _upsert(self, conn, session_id, key, value, digest, is_text):
+        """Point key at a new value/blob and drop a blob nobody references any more"""
+        old = conn.execute(
+            "SELECT blob_hash FROM session_state WHERE session_id = ? AND key = ?",
+            (session_id, key)
+        ).fetchone()
+        conn.execute(
+            """INSERT INTO session_state (session_id, key, value, blob_hash, blob_is_text, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (session_id, key) DO UPDATE SET
+                   value = excluded.value,
+                   blob_hash = excluded.blob_hash,
+                   blob_is_text = excluded.blob_is_text,
+                   updated_at = excluded.updated_at""",
+            (session_id, key, value, digest, int(is_text), time.time())
+        )
+        if old and old[0] and old[0] != digest:
+            self._drop_unreferenced(conn, old[0])
+
+    def _drop_unreferenced(self, conn, digest):
+        conn.execute(
+            "DELETE FROM blobs WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM session_state WHERE blob_hash = ?)",
+            (digest, digest)
+        )
+
+    def stats(self):
+        conn = self._connection()
+        sessions = conn.execute("SELECT COUNT(DISTINCT session_id) FROM session_state").fetchone()[0]
+        blobs, blob_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs").fetchone()
+        refs = conn.execute("SELECT COUNT(*) FROM session_state WHERE blob_hash IS NOT NULL").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "blobs": blobs, "blob_bytes": blob_bytes, "blob_refs": refs}
+
+
+def create_session_store(blob_store=None):
+    """Build the store selected by SESSION_STORE (memory | sqlite)"""
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_STORE_PATH", os.path.join(".cache", "session_state.db")))
+    if backend != "memory":
+        raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+    return InProcessSessionStore(blob_store)
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, FairQueue, QuotaExceeded
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+
+def test_request_bucket_runs_out_after_burst():
+    # No database: the controller falls back to in-process buckets
+    controller = AdmissionController(lambda: None)
+    for _ in range(int(admission.USER_REQUEST_BURST)):
+        controller.admit(1, 10)
+    with pytest.raises(QuotaExceeded) as excinfo:
+        controller.admit(1, 10)
+    assert excinfo.value.retry_after > 0
+    # Other users have their own buckets
+    controller.admit(2, 10)
+
+
+def test_token_bucket_refills_over_time():
+    controller = AdmissionController(lambda: None)
+    controller.admit(1, admission.USER_TOKEN_BURST)
+    with pytest.raises(QuotaExceeded) as excinfo:
+        controller.admit(1, 100)
+    expected = 100 * 60 / admission.USER_TOKENS_PER_MINUTE
+    assert excinfo.value.retry_after == pytest.approx(expected, rel=0.1)
+    # Pretend the refill time has passed
+    requests, allowance, updated_at = controller.local[1]
+    controller.local[1] = (requests, allowance, updated_at - expected - 1)
+    controller.admit(1, 100)
+
+
+def test_admit_wait_ends_when_cancelled():
+    controller = AdmissionController(lambda: None)
+    controller.admit(1, admission.USER_TOKEN_BURST)
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(QuotaExceeded):
+        controller.admit(1, admission.USER_TOKEN_BURST, wait=True, cancel=cancel)
+    assert time.monotonic() - started < 1.0
+
+
+def _queue_up(queue, user, order, cost=1.0, weight=1.0):
+    def run():
+        with queue.slot(user, cost=cost, weight=weight, poll=0.01):
+            order.append(user)
+    thread = threading.Thread(target=run)
+    queued = len(queue.waiting)
+    thread.start()
+    _wait_for(lambda: len(queue.waiting) == queued + 1)
+    return thread
+
+
+def test_queue_interleaves_users_fairly():
+    queue = FairQueue(max_concurrency=1)
+    order = []
+    with queue.slot("busy"):
+        threads = [_queue_up(queue, "busy", order) for _ in range(3)]
+        threads.append(_queue_up(queue, "light", order))
+    for thread in threads:
+        thread.join(2)
+    # The light user arrived last but doesn't wait behind the busy user's backlog
+    assert order.index("light") < 2
+    assert order.count("busy") == 3
+
+
+def test_queue_weight_gives_larger_share():
+    queue = FairQueue(max_concurrency=1)
+    order = []
+    with queue.slot("holder"):
+        threads = [_queue_up(queue, "light", order) for _ in range(2)]
+        threads += [_queue_up(queue, "heavy", order, weight=2.0) for _ in range(2)]
+    for thread in threads:
+        thread.join(2)
+    assert order[:2].count("heavy") >= 1
+    assert order[-1] == "light"
+
+
+def test_aborted_wait_leaves_no_ticket_behind():
+    queue = FairQueue(max_concurrency=1)
+
+    class Rerun(BaseException):
+        pass
+
+    def on_wait(position, eta):
+        raise Rerun()
+
+    with queue.slot("holder"):
+        with pytest.raises(Rerun):
+            with queue.slot("impatient", on_wait=on_wait, poll=0.01):
+                pass
+        assert queue.snapshot() == {"active": 1, "waiting": 0, "max_concurrency": 1}
+    # The next caller isn't stuck behind the abandoned ticket
+    with queue.slot("next", poll=0.01):
+        assert queue.snapshot()["active"] == 1
+    assert queue.snapshot()["active"] == 0
+
+
+def test_reserve_counts_until_released_and_never_jumps_the_queue():
+    queue = FairQueue(max_concurrency=2)
+    first = queue.reserve("a")
+    second = queue.reserve("b", blocking=False)
+    assert second is not None
+    # Cap reached: a non-blocking reservation (e.g. a hedge) is refused
+    assert queue.reserve("c", blocking=False) is None
+    assert queue.snapshot()["waiting"] == 0
+    # A held slot can be released from another thread
+    worker = threading.Thread(target=lambda: second.__exit__(None, None, None))
+    worker.start()
+    worker.join(2)
+    assert queue.snapshot()["active"] == 1
+    with first:
+        pass
+    assert queue.snapshot()["active"] == 0
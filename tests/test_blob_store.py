@@ -0,0 +1,49 @@
+from blob_store import BlobStore
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = BlobStore(spill_dir=str(tmp_path))
+    first = store.put(b"image bytes", ("user:1", "current_image"))
+    second = store.put(b"image bytes", ("user:2", "current_image"))
+    assert first == second
+    stats = store.stats()
+    assert stats["blobs"] == 1
+    assert stats["references"] == 2
+    assert stats["dedup_saved_bytes"] == len(b"image bytes")
+
+
+def test_blob_dropped_with_its_last_reference(tmp_path):
+    store = BlobStore(spill_dir=str(tmp_path))
+    handle = store.put("text", ("user:1", "pdf_text"))
+    store.put("text", ("user:2", "pdf_text"))
+    store.release(("user:1", "pdf_text"))
+    assert store.text(handle) == "text"
+    store.release(("user:2", "pdf_text"))
+    assert store.get(handle) is None
+
+
+def test_spilled_blobs_read_back_from_disk(tmp_path):
+    store = BlobStore(memory_limit=100, spill_dir=str(tmp_path))
+    first = store.put(b"a" * 80, ("user:1", "current_image"))
+    store.put(b"b" * 80, ("user:2", "current_image"))
+    assert store.stats()["spilled_bytes"] == 80
+    assert store.get(first) == b"a" * 80
+    assert store.stats()["resident_bytes"] <= 100
+
+
+def test_putting_the_same_blob_again_keeps_the_memory_limit(tmp_path):
+    store = BlobStore(memory_limit=100, spill_dir=str(tmp_path))
+    store.put(b"a" * 80, ("user:1", "current_image"))
+    store.put(b"b" * 80, ("user:2", "current_image"))
+    # The Image tab saves its blob again on every rerun
+    for _ in range(3):
+        store.put(b"a" * 80, ("user:1", "current_image"))
+        store.put(b"b" * 80, ("user:2", "current_image"))
+    assert store.stats()["resident_bytes"] <= 100
+
+
+def test_base64_savings_count_images_only(tmp_path):
+    store = BlobStore(spill_dir=str(tmp_path))
+    store.put("t" * 300, ("user:1", "pdf_text"))
+    store.put(b"i" * 300, ("user:1", "current_image"), sent_as_base64=True)
+    assert store.stats()["base64_saved_bytes"] == 100
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from model_router import ModelRouter, is_simple_request
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class FakeClient:
+    """Stands in for the Groq client: per-model delay, and models that fail"""
+
+    def __init__(self, delays=None, failing=()):
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.calls = []
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, **kwargs):
+        self.calls.append(model)
+        time.sleep(self.delays.get(model, 0.0))
+        if model in self.failing:
+            raise RuntimeError(f"{model} unavailable")
+        return model
+
+
+def test_rank_puts_failing_model_last():
+    router = ModelRouter()
+    for _ in range(3):
+        router.record("a", 0.1, False)
+    router.record("b", 0.1, True)
+    assert router.rank(["a", "b", "c"], MESSAGES) == ["c", "b", "a"]
+
+
+def test_rank_prefers_fastest_for_simple_requests():
+    router = ModelRouter()
+    router.record("a", 0.5, True)
+    router.record("b", 0.1, True)
+    assert router.rank(["a", "b"], MESSAGES) == ["b", "a"]
+
+
+def test_images_do_not_make_a_request_complex():
+    question = [{"role": "user", "content": [
+        {"type": "text", "text": "What is in this picture?"},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,..."}}
+    ]}]
+    assert is_simple_request(question, "image")
+
+
+def test_simple_size_depends_on_request_type():
+    excerpt = [{"role": "user", "content": "x" * 15000 + " What is this about?"}]
+    assert is_simple_request(excerpt, "pdf")
+    assert not is_simple_request(excerpt, "chat")
+
+
+def test_rank_moves_much_slower_model_back_for_large_requests():
+    router = ModelRouter()
+    router.record("a", 4.0, True)
+    router.record("b", 0.6, True)
+    router.record("c", 0.5, True)
+    long_request = [{"role": "user", "content": "x" * 40000}]
+    # Configured order is kept among comparable models; "a" is far slower than the best
+    assert router.rank(["a", "b", "c"], long_request) == ["b", "c", "a"]
+
+
+def test_failing_model_recovers_once_its_errors_expire():
+    router = ModelRouter(health_seconds=0.05)
+    client = FakeClient()
+    for _ in range(3):
+        router.record("a", 0.01, False)
+    router.record("b", 0.01, True)
+    assert router.complete(client, ["a", "b"], messages=MESSAGES) == ("b", "b")
+
+    time.sleep(0.1)
+    assert router.error_rate("a") == 0.0
+    # With no recent outcomes "a" sorts first again and gets probed
+    assert router.complete(client, ["a", "b"], messages=MESSAGES) == ("a", "a")
+    assert router.error_rate("a") == 0.0
+
+
+def test_complete_fails_over_on_error():
+    router = ModelRouter()
+    client = FakeClient(failing={"a"})
+    response, model = router.complete(client, ["a", "b"], messages=MESSAGES)
+    assert (response, model) == ("b", "b")
+    assert client.calls == ["a", "b"]
+    assert router.metrics["failovers"] == 1
+    assert router.error_rate("a") == 1.0
+
+
+def test_complete_raises_when_every_model_fails():
+    router = ModelRouter()
+    client = FakeClient(failing={"a", "b"})
+    with pytest.raises(RuntimeError):
+        router.complete(client, ["a", "b"], messages=MESSAGES)
+
+
+def test_slow_primary_is_hedged():
+    router = ModelRouter()
+    for _ in range(5):
+        router.record("a", 0.02, True)
+    router.record("b", 0.05, True)
+    client = FakeClient(delays={"a": 0.5, "b": 0.0})
+    started = time.monotonic()
+    response, model = router.complete(client, ["a", "b"], messages=MESSAGES)
+    assert model == "b"
+    assert time.monotonic() - started < 0.4
+    assert router.metrics["hedges_fired"] == 1
+    assert router.metrics["hedge_wins"] == 1
+    assert router.metrics["last_decision"]["primary"] == "a"
+
+
+def test_hedge_skipped_without_a_free_slot():
+    router = ModelRouter()
+    for _ in range(5):
+        router.record("a", 0.02, True)
+    router.record("b", 0.05, True)
+    client = FakeClient(delays={"a": 0.1})
+
+    def reserve(blocking):
+        # The cap is reached: only blocking reservations (the primary) get a slot
+        return _Slot() if blocking else None
+
+    assert router.complete(client, ["a", "b"], reserve=reserve, messages=MESSAGES) == ("a", "a")
+    assert router.metrics["hedges_fired"] == 0
+    assert client.calls == ["a"]
+
+
+class _Slot:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
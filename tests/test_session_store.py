@@ -0,0 +1,45 @@
+import time
+
+from blob_store import BlobStore
+from session_store import InProcessSessionStore
+
+
+def test_idle_sessions_expire_and_release_their_blobs():
+    blobs = BlobStore()
+    store = InProcessSessionStore(blobs, idle_seconds=0.05)
+    store.set("user:1", "messages", [{"role": "user", "content": "hi"}])
+    store.set_blob("user:1", "pdf_text", "document text")
+    time.sleep(0.1)
+    store.set("user:2", "messages", [])
+    assert store.get("user:1", "messages") is None
+    assert store.get_blob("user:1", "pdf_text") is None
+    assert blobs.stats()["blobs"] == 0
+    assert store.stats()["sessions"] == 1
+    assert store.stats()["expired_sessions"] == 1
+
+
+def test_least_recently_used_session_dropped_over_the_cap():
+    store = InProcessSessionStore(max_sessions=2)
+    store.set("a", "messages", [1])
+    store.set("b", "messages", [2])
+    store.get("a", "messages")
+    store.set("c", "messages", [3])
+    assert store.get("a", "messages") == [1]
+    assert store.get("b", "messages") is None
+    assert store.get("c", "messages") == [3]
+
+
+def test_append_keeps_turns_from_every_writer():
+    store = InProcessSessionStore()
+    store.set("user:1", "messages", [{"role": "user", "content": "first"}])
+    store.append("user:1", "messages", {"role": "assistant", "content": "from tab 1"})
+    turns = store.append("user:1", "messages", {"role": "assistant", "content": "from tab 2"})
+    assert [turn["content"] for turn in turns] == ["first", "from tab 1", "from tab 2"]
+
+
+def test_append_after_expiry_starts_from_the_callers_copy():
+    store = InProcessSessionStore(idle_seconds=0.05)
+    store.set("user:1", "messages", [1, 2])
+    time.sleep(0.1)
+    store.set("user:2", "messages", [])
+    assert store.append("user:1", "messages", 3, initial=[1, 2]) == [1, 2, 3]